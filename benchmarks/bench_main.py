@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Benchmarks ``find_agg`` end-to-end and stage by stage upon a synthetic CMIP5 tree
+              and a local THREDDS stand-in server.
+
+   Run from the repository root with ``python -m benchmarks.bench_main [options] [-- find_agg options]``.
+   The JSON report allows to compare versions.
+
+"""
+
+# Module imports
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import findagg.findagg as findagg
+from benchmarks.synthetic import SyntheticTree
+from benchmarks.thredds import ThreddsServer
+
+
+class Timer(object):
+    """
+    Records the elapsed time of a ``with`` block into a report.
+
+    """
+
+    def __init__(self, report, name):
+        self.report = report
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc):
+        self.report[self.name] = round(time.time() - self.start, 4)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmarks find_agg upon a synthetic CMIP5 tree.')
+    parser.add_argument('--institutes', type=int, default=4, help='Number of institutes.')
+    parser.add_argument('--models', type=int, default=3, help='Number of models per institute.')
+    parser.add_argument('--experiments', type=int, default=3, help='Number of experiments.')
+    parser.add_argument('--ensembles', type=int, default=3, help='Number of ensembles per experiment.')
+    parser.add_argument('--variables', type=int, default=3, help='Number of variables.')
+    parser.add_argument('--missing-data', type=float, default=0.1, help='Fraction of aggregations without data.')
+    parser.add_argument('--missing-xml', type=float, default=0.1, help='Fraction of aggregations without xml.')
+    parser.add_argument('--missing-url', type=float, default=0.1, help='Fraction of aggregations not on THREDDS.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Server latency in seconds.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of HTTP 503 responses.')
+    parser.add_argument('--hang-rate', type=float, default=0.0,
+                        help='Fraction of responses delayed beyond the timeout.')
+    parser.add_argument('--reset-rate', type=float, default=0.0, help='Fraction of connections dropped.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic tree.')
+    parser.add_argument('--output', type=str, help='JSON report file (standard output by default).')
+    parser.add_argument('findagg', nargs=argparse.REMAINDER, help='Options passed to find_agg after "--".')
+    args = parser.parse_args()
+    args.findagg = [arg for arg in args.findagg if arg != '--']
+    return args
+
+
+def run_main(argv):
+    """
+    Runs ``find_agg`` main process with the given command-line.
+
+    """
+    sys.argv = ['find_agg'] + argv
+    findagg.main()
+
+
+def run_stages(argv, report):
+    """
+    Runs ``find_agg`` stage by stage with a fresh processing context and times each stage.
+
+    """
+    sys.argv = ['find_agg'] + argv
+    args = findagg.get_args()
+    with Timer(report, 'context'):
+        ctx = findagg.ProcessingContext(args, findagg.get_requirements(args.inputfile[0]))
+    with Timer(report, 'index'):
+        units = [(institute, model) for institute in ctx.institutes for model in institute.models]
+        for institute, model in units:
+            ctx.index.build(institute.name, model)
+    contexts = [findagg.get_model_context(ctx, institute, model) for institute, model in units]
+    with Timer(report, 'aggregations'):
+        aggregations = [list(findagg.get_aggregations(model_ctx)) for model_ctx in contexts]
+    with Timer(report, 'xmls'):
+        for model_aggregations in aggregations:
+            ctx.store.xmls(model_aggregations)
+    with Timer(report, 'urls'):
+        for model_aggregations in aggregations:
+            ctx.store.urls(model_aggregations)
+    with Timer(report, 'trees'):
+        for model_aggregations in aggregations:
+            ctx.store.trees(model_aggregations)
+    with Timer(report, 'outputs'):
+        for institute, model in units:
+            findagg.collect(ctx, findagg.process_model(ctx, institute, model))
+        for writer in [ctx.agg_writer, ctx.miss_writer]:
+            if writer:
+                writer.close()
+    ctx.pool.close()
+    ctx.pool.join()
+    ctx.prober.close()
+    if ctx.cache:
+        ctx.cache.close()
+    report['total'] = round(sum(report.values()), 4)
+    report['metrics'] = ctx.metrics.summary()
+
+
+def main():
+    args = get_args()
+    workdir = tempfile.mkdtemp(prefix='findagg-bench-')
+    server = None
+    try:
+        root = os.path.join(workdir, 'CMIP5')
+        report = {'version': findagg.__version__,
+                  'python': platform.python_version(),
+                  'parameters': dict((k, v) for k, v in vars(args).items() if k != 'output')}
+        with Timer(report, 'generation'):
+            tree = SyntheticTree(root, args.institutes, args.models, args.experiments, args.ensembles,
+                                 args.variables, args.missing_data, args.missing_xml, args.missing_url, args.seed)
+        report['tree'] = tree.counts
+        server = ThreddsServer(args.latency, args.error_rate, tree.available, tree.datasets,
+                               hang_rate=args.hang_rate, reset_rate=args.reset_rate).start()
+        findagg.CMIP5 = findagg.XML_ROOT = root
+        findagg.THREDDS_ROOT = server.root
+        findagg.THREDDS_CATALOG = server.catalog
+        requirements = os.path.join(workdir, 'requirements.json')
+        with open(requirements, 'w') as f:
+            json.dump(tree.requirements, f)
+        # The status-only mode writes no list
+        status_only = '--status-only' in args.findagg
+        outputs = [] if status_only else ['--agg', os.path.join(workdir, 'aggregations.list'),
+                                          '--miss', os.path.join(workdir, 'missing_data.list')]
+        argv = [requirements] + outputs + ['--log', os.path.join(workdir, 'findagg.log')] + args.findagg
+        open(os.path.join(workdir, 'findagg.log'), 'w').close()
+        report['main'] = dict()
+        with Timer(report['main'], 'seconds'):
+            run_main(argv)
+        report['main']['requests'] = server.count
+        if not status_only:
+            for name in ['aggregations.list', 'missing_data.list']:
+                with open(os.path.join(workdir, name)) as f:
+                    report['main'][name] = sum(1 for _ in f)
+            server.count = 0
+            report['stages'] = dict()
+            run_stages(argv, report['stages'])
+            report['stages']['requests'] = server.count
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(output + '\n')
+        else:
+            print(output)
+    finally:
+        if server:
+            server.stop()
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
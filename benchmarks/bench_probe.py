@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Benchmarks THREDDS aggregation probing against a local stand-in server.
+
+   Run from the repository root with ``python -m benchmarks.bench_probe``.
+
+"""
+
+# Module imports
+import argparse
+import json
+import time
+from itertools import product
+from multiprocessing.dummy import Pool as ThreadPool
+
+from benchmarks.thredds import ThreddsServer
+from findagg.findagg import THREDDS_AGGREGATION_HTML_EXT, URLProber, test_url
+
+
+def get_urls(root, count):
+    """
+    Yields fake aggregation urls upon the stand-in server.
+
+    :param str root: The THREDDS root url
+    :param int count: The number of urls
+    :returns: An iterator on aggregation urls
+    :rtype: *iter*
+
+    """
+    variables = ['tas', 'pr', 'ps', 'uas', 'vas', 'huss', 'rsds', 'rlds', 'psl', 'ts']
+    for i, variable in product(range(count // 10 + 1), variables):
+        if count <= 0:
+            break
+        count -= 1
+        yield '.'.join([root, 'IPSL', 'IPSL-CM5A-LR', 'historical', 'day', 'atmos', 'day',
+                        'r{0}i1p1'.format(i), variable, THREDDS_AGGREGATION_HTML_EXT])
+
+
+def timeit(function, urls):
+    """
+    Returns the elapsed time and the number of existing urls.
+
+    """
+    start = time.time()
+    found = sum(1 for exists in function(urls) if exists)
+    return {'seconds': round(time.time() - start, 4), 'found': found}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks THREDDS probing upon a local stand-in server.')
+    parser.add_argument('--urls', type=int, default=500, help='Number of aggregation urls to probe.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Server latency in seconds.')
+    parser.add_argument('--threads', type=int, default=16, help='Concurrent requests of the pooled prober.')
+    parser.add_argument('--host-threads', type=int, default=16, help='Concurrent requests per host.')
+    args = parser.parse_args()
+    server = ThreddsServer(latency=args.latency).start()
+    urls = list(get_urls(server.root, args.urls))
+    try:
+        results = dict()
+        # Former behaviour: one new connection per url, one url at a time
+        results['serial'] = timeit(lambda u: map(test_url, u), urls)
+        prober = URLProber(args.threads, args.host_threads)
+        pool = ThreadPool(args.threads)
+        results['pooled'] = timeit(lambda u: pool.map(prober, u), urls)
+        pool.close()
+        pool.join()
+        prober.close()
+        results['speedup'] = round(results['serial']['seconds'] / results['pooled']['seconds'], 2)
+        results['requests'] = server.count
+        print(json.dumps(results, indent=2, sort_keys=True))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Benchmarks ``find_agg`` import and startup times and the requirements validation.
+
+   Run from the repository root with ``python -m benchmarks.bench_startup``.
+   The JSON report allows to compare versions.
+
+"""
+
+# Module imports
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import findagg.findagg as findagg
+
+# Third-party modules that should not be imported before they are needed
+DEFERRED = ['requests', 'jsonschema', 'numpy', 'pyarrow']
+
+
+def run(code, repeat):
+    """
+    Returns the median wall time of a Python process running some code.
+
+    :param str code: The Python code
+    :param int repeat: The number of runs
+    :returns: The median time in seconds
+    :rtype: *float*
+
+    """
+    times = list()
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.call([sys.executable, '-c', code], stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+    return round(sorted(times)[len(times) // 2], 4)
+
+
+def get_cli(argv):
+    """
+    Returns the Python code running ``find_agg`` with some arguments.
+
+    """
+    return 'import sys; sys.argv = {0!r}; from findagg.findagg import main; main()'.format(['find_agg'] + argv)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks find_agg startup.')
+    parser.add_argument('--repeat', type=int, default=11, help='Number of runs of each process.')
+    parser.add_argument('--validations', type=int, default=1000, help='Number of requirements validations.')
+    parser.add_argument('--output', type=str, help='JSON report file (standard output by default).')
+    args = parser.parse_args()
+    report = {'version': findagg.__version__,
+              'python': platform.python_version(),
+              'parameters': {'repeat': args.repeat, 'validations': args.validations}}
+    # Processes, the interpreter startup being measured alone
+    report['processes'] = {'interpreter': run('pass', args.repeat),
+                           'import': run('import findagg.findagg', args.repeat),
+                           'help': run(get_cli(['-h']), args.repeat),
+                           'version': run(get_cli(['-V']), args.repeat)}
+    imported = subprocess.check_output([sys.executable, '-c',
+                                        'import sys, findagg.findagg; print(" ".join(sys.modules))'])
+    imported = imported.decode('utf-8').split()
+    report['deferred'] = dict((module, module not in imported) for module in DEFERRED)
+    # Requirements validation, the first one compiling the validator
+    path = os.path.join(os.path.dirname(os.path.abspath(findagg.__file__)), 'requirements.json')
+    with open(path) as f:
+        requirements = json.load(f)
+    start = time.time()
+    findagg.validate_requirements(requirements)
+    report['validation'] = {'first': round(time.time() - start, 6)}
+    start = time.time()
+    for _ in range(args.validations):
+        findagg.validate_requirements(requirements)
+    report['validation']['next'] = round((time.time() - start) / args.validations, 6)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
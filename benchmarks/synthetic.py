@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Generates a synthetic CMIP5 tree following the DRS with a chosen fraction of missing aggregations.
+
+"""
+
+# Module imports
+import os
+import random
+
+from findagg.findagg import LATEST, XML_AGGREGATION_EXT
+
+# Experiments to pick from (in the requirements vocabulary)
+EXPERIMENTS = ['historical', 'rcp26', 'rcp45', 'rcp60', 'rcp85', 'piControl', 'amip', '1pctCO2', 'abrupt4xCO2',
+               'historicalNat', 'historicalGHG', 'sstClim', 'midHolocene', 'lgm', 'past1000', 'esmControl']
+
+# Variables to pick from with their (frequency, realm, table) tuple
+VARIABLES = [('tas', ['day', 'atmos', 'day']), ('pr', ['mon', 'atmos', 'Amon']),
+             ('psl', ['mon', 'atmos', 'Amon']), ('tos', ['mon', 'ocean', 'Omon']),
+             ('sic', ['mon', 'seaIce', 'OImon']), ('mrso', ['mon', 'land', 'Lmon']),
+             ('uas', ['3hr', 'atmos', '3hr']), ('ta', ['6hr', 'atmos', '6hrPlev']),
+             ('zos', ['mon', 'ocean', 'Omon']), ('huss', ['day', 'atmos', 'day']),
+             ('rsds', ['mon', 'atmos', 'Amon']), ('snc', ['mon', 'landIce', 'LImon'])]
+
+
+class SyntheticTree(object):
+    """
+    Builds a CMIP5 tree with one empty netCDF file per aggregation.
+    Each (model, experiment, ensemble, variable) aggregation independently misses its data, its CDAT xml file
+    or its THREDDS publication with the given probabilities.
+
+    :param str root: The CMIP5 root folder to create
+    :param int institutes: The number of institutes
+    :param int models: The number of models per institute
+    :param int experiments: The number of experiments
+    :param int ensembles: The number of ensembles per experiment
+    :param int variables: The number of variables
+    :param float missing_data: The fraction of aggregations without data
+    :param float missing_xml: The fraction of aggregations with data but without xml file
+    :param float missing_url: The fraction of aggregations with data but not published on THREDDS
+    :param int seed: The random seed
+    :returns: The synthetic tree
+    :rtype: *SyntheticTree*
+
+    """
+
+    def __init__(self, root, institutes=4, models=3, experiments=3, ensembles=3, variables=3,
+                 missing_data=0.1, missing_xml=0.1, missing_url=0.1, seed=0):
+        self.root = root
+        self.variables = dict(VARIABLES[:variables])
+        self.experiments = EXPERIMENTS[:experiments]
+        self.published = set()
+        self.counts = dict.fromkeys(['aggregations', 'data', 'xmls', 'published'], 0)
+        rand = random.Random(seed)
+        for i in range(institutes):
+            institute = 'INST{0}'.format(i)
+            for j in range(models):
+                model = 'MODEL{0}-{1}'.format(i, j)
+                for experiment in self.experiments:
+                    for k in range(1, ensembles + 1):
+                        ensemble = 'r{0}i1p1'.format(k)
+                        for variable, table in sorted(self.variables.items()):
+                            self.add(rand, [institute, model, experiment] + table + [ensemble], variable,
+                                     missing_data, missing_xml, missing_url)
+
+    def add(self, rand, facets, variable, missing_data, missing_xml, missing_url):
+        """
+        Creates an aggregation directory with its files.
+
+        """
+        self.counts['aggregations'] += 1
+        if rand.random() < missing_data:
+            return
+        directory = os.path.join(self.root, *(facets + [LATEST, variable]))
+        os.makedirs(directory)
+        model, experiment, table, ensemble = facets[1], facets[2], facets[5], facets[6]
+        name = '_'.join([variable, table, model, experiment, ensemble])
+        open(os.path.join(directory, '{0}_185001-200512.nc'.format(name)), 'w').close()
+        self.counts['data'] += 1
+        if rand.random() >= missing_xml:
+            open(os.path.join(directory, '{0}{1}'.format(name, XML_AGGREGATION_EXT)), 'w').close()
+            self.counts['xmls'] += 1
+        if rand.random() >= missing_url:
+            self.published.add('.'.join(['cmip5-pp.output'] + facets + [variable]))
+            self.counts['published'] += 1
+
+    @property
+    def requirements(self):
+        """
+        The JSON requirements requesting every aggregation of the tree.
+
+        """
+        return {'variables': self.variables, 'experiments': self.experiments, 'ensembles': ['*']}
+
+    def available(self, dataset):
+        """
+        Returns True if a dataset is published on THREDDS.
+
+        """
+        return dataset in self.published
+
+    def datasets(self, institute, model):
+        """
+        Returns the datasets of a model published on THREDDS.
+
+        """
+        prefix = '.'.join(['cmip5-pp.output', institute, model, ''])
+        return sorted(dataset for dataset in self.published if dataset.startswith(prefix))
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Local stand-in for the IPSL THREDDS server answering aggregation requests.
+
+"""
+
+# Module imports
+import random
+import time
+import zlib
+from threading import Thread
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from findagg.findagg import THREDDS_AGGREGATION_HTML_EXT
+
+# Stand-in THREDDS OpenDAP service path
+DODS_PATH = '/thredds/dodsC/'
+
+# Stand-in THREDDS catalog service path
+CATALOG_PATH = '/thredds/catalog/cmip5-pp/output/'
+
+# THREDDS catalog template (formatted with the aggregations datasets)
+CATALOG = """<?xml version="1.0" encoding="UTF-8"?>
+<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0"
+         xmlns:xlink="http://www.w3.org/1999/xlink" version="1.0.1">
+  <service name="OpenDAP" serviceType="OPENDAP" base="/thredds/dodsC/"/>
+{0}
+</catalog>
+"""
+
+# THREDDS catalog aggregation dataset template
+CATALOG_DATASET = """  <dataset name="{0}" ID="{0}" urlPath="{0}.1.aggregation.1">
+    <serviceName>OpenDAP</serviceName>
+  </dataset>"""
+
+# THREDDS catalog reference template (formatted with the relative catalog url)
+CATALOG_REF = """  <catalogRef xlink:href="{0}" xlink:title="{0}" name=""/>"""
+
+
+class ThreddsHandler(BaseHTTPRequestHandler):
+    """
+    Answers ``HEAD`` and ``GET`` requests upon ``*.1.aggregation.1.html`` endpoints
+    and ``<institute>/<model>[/<experiment>]/catalog.xml`` catalogs with keep-alive connections.
+    The server attributes drive the responses.
+
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def do_GET(self):
+        self.respond(body=True)
+
+    def respond(self, body):
+        server = self.server
+        server.count += 1
+        if server.latency:
+            time.sleep(server.latency)
+        content = None
+        fault = random.random()
+        if fault < server.hang_rate:
+            # Answers after the client timeout
+            time.sleep(server.hang)
+        elif fault < server.hang_rate + server.reset_rate:
+            # Drops the connection without any response
+            self.close_connection = True
+            return
+        if server.error_rate and random.random() < server.error_rate:
+            code = 503
+        elif self.path.startswith(CATALOG_PATH) and self.path.endswith('/catalog.xml'):
+            content = self.get_catalog(self.path[len(CATALOG_PATH):].split('/')[:-1])
+            code = 404 if content is None else 200
+        elif not self.path.startswith(DODS_PATH) or not self.path.endswith(THREDDS_AGGREGATION_HTML_EXT):
+            code = 404
+        elif server.available(self.path[len(DODS_PATH):-len(THREDDS_AGGREGATION_HTML_EXT) - 1]):
+            code = 200
+        else:
+            code = 404
+        if content is None:
+            content = 'OK\n' if code == 200 else 'Not found\n'
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/xml' if self.path.endswith('.xml') else 'text/html')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if body:
+            self.wfile.write(content.encode('utf-8'))
+
+    def get_catalog(self, facets):
+        """
+        Returns the catalog of a model, or of an experiment of a model in nested mode,
+        or None if the server does not publish the catalog.
+        A nested model catalog references the catalogs of its experiments, which reference it back.
+
+        """
+        if not self.server.datasets or len(facets) not in (2, 3) or len(facets) == 3 and not self.server.nested:
+            return None
+        datasets = self.server.datasets(*facets[:2])
+        if datasets is None:
+            return None
+        # Dataset identifiers start with the project, the product, the institute and the model
+        experiments = sorted(set(dataset.split('.')[4] for dataset in datasets))
+        if len(facets) == 3:
+            entries = [CATALOG_REF.format('../catalog.xml')]
+            entries.extend(CATALOG_DATASET.format(dataset) for dataset in datasets
+                           if dataset.split('.')[4] == facets[2])
+        elif self.server.nested:
+            entries = [CATALOG_REF.format('{0}/catalog.xml'.format(experiment)) for experiment in experiments]
+        else:
+            entries = [CATALOG_DATASET.format(dataset) for dataset in datasets]
+        return CATALOG.format('\n'.join(entries))
+
+    def log_message(self, *args):
+        # Keeps the benchmark output quiet.
+        pass
+
+
+class ThreddsServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server mimicking the THREDDS aggregation endpoints.
+
+    :param float latency: The delay in seconds before each response
+    :param float error_rate: The fraction of requests answered with an HTTP 503 error
+    :param float hang_rate: The fraction of requests answered after an extra delay of ``hang`` seconds
+    :param float reset_rate: The fraction of connections dropped without response
+    :param function available: Returns True if a dataset identifier (without extension) exists
+    :param function datasets: Returns the dataset identifiers of an institute and a model to publish in catalogs,
+                              None if the model has no catalog
+    :param boolean nested: True to publish a catalog per experiment referenced by the model catalog
+    :param int port: The localhost port to listen to (a free one by default)
+    :returns: The stand-in server listening on localhost
+    :rtype: *ThreddsServer*
+
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency=0.0, error_rate=0.0, available=None, datasets=None, port=0,
+                 hang_rate=0.0, reset_rate=0.0, hang=2.0, nested=False):
+        HTTPServer.__init__(self, ('127.0.0.1', port), ThreddsHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.reset_rate = reset_rate
+        self.hang = hang
+        self.available = available or ratio(0.8)
+        self.datasets = datasets
+        self.nested = nested
+        self.count = 0
+
+    @property
+    def root(self):
+        """
+        The THREDDS root url to use instead of :data:`findagg.findagg.THREDDS_ROOT`.
+
+        """
+        return 'http://127.0.0.1:{0}{1}cmip5-pp.output'.format(self.server_port, DODS_PATH)
+
+    @property
+    def catalog(self):
+        """
+        The THREDDS catalog template to use instead of :data:`findagg.findagg.THREDDS_CATALOG`.
+
+        """
+        return 'http://127.0.0.1:{0}{1}{{0}}/{{1}}/catalog.xml'.format(self.server_port, CATALOG_PATH)
+
+    def handle_error(self, request, client_address):
+        # Clients give up on delayed responses, which is expected.
+        pass
+
+    def start(self):
+        """
+        Serves requests from a background thread.
+
+        """
+        thread = Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving and releases the listening socket.
+
+        """
+        self.shutdown()
+        self.server_close()
+
+
+def ratio(fraction):
+    """
+    Returns a deterministic availability function keeping a fraction of the datasets.
+
+    :param float fraction: The fraction of existing datasets
+    :returns: The availability function
+    :rtype: *function*
+
+    """
+    return lambda dataset: zlib.crc32(dataset.encode('utf-8')) % 1000 < fraction * 1000
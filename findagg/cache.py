@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Persistent cache of the aggregation tests results shared between runs.
+
+"""
+
+# Module imports
+import os
+import sqlite3
+import time
+from json import dumps, loads
+from threading import Lock
+
+# Time to trust a positive test result in seconds
+POSITIVE_TTL = 7 * 24 * 3600
+
+# Time to trust a negative test result in seconds
+NEGATIVE_TTL = 24 * 3600
+
+# Cache miss marker
+MISSING = object()
+
+
+class ProbeCache(object):
+    """
+    Stores the tests results into a SQLite database in WAL mode.
+    A cached result is only returned if it is younger than its time-to-live.
+    Positive results are trusted longer than negative ones.
+
+    :param str path: The database file
+    :param int max_age: The maximum age in seconds of any result to use
+    :param boolean refresh: True to ignore the cached results (new results are still recorded)
+    :param int positive_ttl: The time-to-live in seconds of a positive result
+    :param int negative_ttl: The time-to-live in seconds of a negative result
+    :returns: The probe cache
+    :rtype: *ProbeCache*
+
+    """
+
+    def __init__(self, path, max_age=None, refresh=False, positive_ttl=POSITIVE_TTL, negative_ttl=NEGATIVE_TTL):
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        self.refresh = refresh
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        if max_age is not None:
+            self.positive_ttl = min(self.positive_ttl, max_age)
+            self.negative_ttl = min(self.negative_ttl, max_age)
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS results ('
+                        'test TEXT NOT NULL, '
+                        'key TEXT NOT NULL, '
+                        'result TEXT, '
+                        'positive INTEGER NOT NULL, '
+                        'time REAL NOT NULL, '
+                        'PRIMARY KEY (test, key))')
+        self.db.commit()
+
+    def get(self, test, key):
+        """
+        Returns a cached test result.
+
+        :param str test: The test name
+        :param str key: The tested url or path
+        :returns: The test result or :data:`MISSING` if not cached or expired
+        :rtype: *object*
+
+        """
+        if self.refresh:
+            return MISSING
+        with self.lock:
+            row = self.db.execute('SELECT result, positive, time FROM results WHERE test = ? AND key = ?',
+                                  (test, key)).fetchone()
+        if row is None:
+            return MISSING
+        result, positive, timestamp = row
+        if time.time() - timestamp > (self.positive_ttl if positive else self.negative_ttl):
+            return MISSING
+        return loads(result)
+
+    def set(self, test, results):
+        """
+        Records tests results in a single transaction.
+
+        :param str test: The test name
+        :param list results: The (key, result, positive) tuples to record
+
+        """
+        now = time.time()
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO results (test, key, result, positive, time) '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                [(test, key, dumps(result), int(positive), now) for key, result, positive in results])
+            self.db.commit()
+
+    def close(self):
+        """
+        Closes the database.
+
+        """
+        with self.lock:
+            self.db.close()
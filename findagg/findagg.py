@@ -7,18 +7,51 @@
 
 # Module imports
 import argparse
+import hashlib
+import json
 import logging
 import os
+import random
+import re
+import sys
 import textwrap
+import time
 from argparse import HelpFormatter
+from collections import namedtuple
+from contextlib import closing
+from copy import copy
 from datetime import datetime
-from glob import glob
-from itertools import product, ifilterfalse
+from fnmatch import fnmatch
+from itertools import product
 from json import load
 from multiprocessing.dummy import Pool as ThreadPool
-
-import requests
-from jsonschema import validate
+from threading import Condition, Event, Lock, local
+
+from .cache import MISSING, ProbeCache
+from .journal import Journal
+from .matrix import StatusMatrix, check_format
+from .metrics import Metrics
+from .output import SortedWriter, write_atomically
+from .pipeline import Pipeline
+from .snapshot import Snapshot
+
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+try:
+    from urlparse import urljoin, urlparse
+except ImportError:
+    from urllib.parse import urljoin, urlparse
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 # Program version
 __version__ = 'v{0} {1}'.format('0.6.2', datetime(year=2018, month=4, day=11).strftime("%Y-%d-%m"))
@@ -26,12 +59,21 @@ __version__ = 'v{0} {1}'.format('0.6.2', datetime(year=2018, month=4, day=11).st
 # THREDDS server root url
 THREDDS_ROOT = 'https://vesg.ipsl.upmc.fr/thredds/dodsC/cmip5-pp.output'
 
+# THREDDS catalog url of a model (formatted with institute and model)
+THREDDS_CATALOG = 'https://vesg.ipsl.upmc.fr/thredds/catalog/cmip5-pp/output/{0}/{1}/catalog.xml'
+
+# THREDDS catalog reference attribute
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
 # THREDDS aggregation html file extension
 THREDDS_AGGREGATION_HTML_EXT = '1.aggregation.1.html'
 
 # THREDDS aggregation html file extension
 XML_AGGREGATION_EXT = '.xml'
 
+# Files of a CDAT xml aggregation file map, i.e. the last item of each [start,end,...,file] list
+XML_AGGREGATION_FILE = re.compile(r'\[(?:-|\d+),(?:[^\[\],]*,){3,}([^\[\],]+)\]')
+
 # Filesystem CMIP5 root folder
 CMIP5 = '/prodigfs/project/CMIP5/output'
 
@@ -45,12 +87,47 @@ XML_ROOT = '/prodigfs/project/CMIP5/output'
 LATEST = 'latest'
 
 # Throttle upon number of threads to spawn
-THREAD_POOL_SIZE = 1
+THREAD_POOL_SIZE = 16
+
+# Throttle upon number of simultaneous HTTP requests per host
+HOST_POOL_SIZE = 8
+
+# HTTP request timeout in seconds
+HTTP_TIMEOUT = 1
+
+# THREDDS catalog download timeout in seconds
+CATALOG_TIMEOUT = 30
+
+# HTTP latency in seconds above which the concurrency decreases
+HTTP_LATENCY_TARGET = 0.5
+
+# Number of retries upon transient HTTP failures
+HTTP_RETRIES = 3
+
+# Base delay in seconds of the exponential backoff between retries
+HTTP_BACKOFF = 0.2
+
+# HTTP status codes of transient failures
+HTTP_TRANSIENT_CODES = [429, 500, 502, 503, 504]
+
+# Number of consecutive HTTP failures opening the circuit breaker
+CIRCUIT_THRESHOLD = 20
+
+# Time in seconds between trial requests while the circuit breaker is open
+CIRCUIT_COOLDOWN = 30
 
 # Aggregation status
 COMPLETE = 'COMPLETE'
 INCOMPLETE = 'INCOMPLETE'
 NONE = 'NONE'
+UNKNOWN = 'UNKNOWN'
+STALE = 'STALE'
+
+# Requirements JSON schema validator (compiled upon first use)
+VALIDATOR = None
+
+# Thread-local state telling the workers of the pools apart
+WORKER = local()
 
 
 class MultilineFormatter(HelpFormatter):
@@ -93,47 +170,942 @@ class MultilineFormatter(HelpFormatter):
 class InstituteInfo(object):
     """
     Gives the list of models from an institute regarding to the DRS.
+    The institute directory is only listed when the models are first needed.
 
     :param str name: The institute to process
+    :param DRSIndex index: The index of the CMIP5 tree
     :returns: The models from the institute
     :rtype: *list*
 
     """
 
-    def __init__(self, name):
+    def __init__(self, name, index):
         self.name = name
-        self.models = os.listdir(os.path.join(CMIP5, name))
+        self.index = index
+
+    @property
+    def models(self):
+        return self.index.listdir(self.name)
+
+
+class DRSIndex(object):
+    """
+    In-memory tree of the CMIP5 directories restricted to the requirements, following the DRS:
+    ``<institute>/<model>/<experiment>/<frequency>/<realm>/<table>/<ensemble>/latest/<variable>``.
+    The tree is built lazily: the CMIP5 root folder and the institutes are listed when first needed
+    and the tree of a model is walked once, level by level, listing all directories of a level concurrently.
+    Institutes and models excluded by the requirements are never listed.
+    In incremental mode, a directory is only listed again if its times changed since the snapshot.
+    Otherwise, the directories listings can be shared with the indexes of other requests.
+
+    :param dict requirements: The user requirements
+    :param pool pool: The pool of workers listing the directories
+    :param Metrics metrics: The run metrics (optional)
+    :param Snapshot snapshot: The snapshot of the previous run (optional)
+    :param dict listings: The directories listings shared between indexes (optional)
+    :returns: The DRS index
+    :rtype: *DRSIndex*
+
+    """
+
+    def __init__(self, requirements, pool, metrics=None, snapshot=None, listings=None):
+        self.metrics = metrics or Metrics()
+        self.snapshot = snapshot
+        self.listings = dict() if listings is None else listings
+        self.pool = pool
+        self.institutes = requirements.get('institutes', ['*'])
+        self.models = requirements.get('models', ['*'])
+        self.ensembles = requirements['ensembles']
+        self.experiments = set(requirements['experiments'])
+        self.variables = requirements['variables']
+        self.tables = set()
+        for table in self.variables.values():
+            self.tables.update(tuple(table[:i]) for i in range(1, len(table) + 1))
+        self.children = dict()
+        self.locks = dict()
+        self.lock = Lock()
+
+    def build(self, *facets):
+        """
+        Walks the tree of a directory down to the variable level, unless already done.
+        The CMIP5 root folder and the institutes directories are only listed, not walked.
+
+        :param str facets: The directory facets from the CMIP5 root folder, at most an institute and a model
+
+        """
+        with self.lock:
+            lock = self.locks.setdefault(facets, Lock())
+        with lock:
+            if facets in self.children:
+                return
+            if len(facets) < 2:
+                self.children[facets] = sorted(child for child in self.read(facets) if self.match(facets, child))
+                return
+            # A worker waiting for the pool it belongs to could wait forever
+            pool_map = map if is_worker() else self.pool.map
+            level = [facets]
+            children = dict()
+            while level:
+                names = pool_map(self.read, level)
+                next_level = list()
+                for parent, names in zip(level, names):
+                    children[parent] = sorted(child for child in names if self.match(parent, child))
+                    next_level.extend(parent + (child,) for child in children[parent])
+                if len(level[0]) == 8:
+                    # Variables directories are not listed, their times are only checked in incremental mode
+                    if self.snapshot:
+                        list(pool_map(self.check, next_level))
+                    break
+                level = next_level
+            self.children.update(children)
+
+    def read(self, facets):
+        """
+        Lists a directory, using the snapshot in incremental mode or the shared listings otherwise.
+
+        :param tuple facets: The directory facets from the CMIP5 root folder
+        :returns: The sub-directories names
+        :rtype: *list*
+
+        """
+        path = os.path.join(CMIP5, *facets)
+        if self.snapshot:
+            self.metrics.count('stat_calls')
+            return self.snapshot.listdir(facets, path, self.list_dirs)
+        if path not in self.listings:
+            self.listings[path] = self.list_dirs(path)
+        return self.listings[path]
+
+    def check(self, facets):
+        """
+        Records the times of a directory without listing it into the snapshot.
+
+        :param tuple facets: The directory facets from the CMIP5 root folder
+
+        """
+        self.metrics.count('stat_calls')
+        self.snapshot.listdir(facets, os.path.join(CMIP5, *facets), None)
+
+    def list_dirs(self, path):
+        """
+        Like :func:`list_dirs`, but counts the call.
+
+        """
+        self.metrics.count('listdir_calls')
+        return list_dirs(path)
+
+    def match(self, facets, name):
+        """
+        Returns True if a directory name is relevant regarding to the requirements.
+
+        :param tuple facets: The parent directory facets
+        :param str name: The directory name
+        :returns: True if the directory has to be indexed
+        :rtype: *boolean*
+
+        """
+        depth = len(facets)
+        if depth == 0:
+            return any(fnmatch(name, institute) for institute in self.institutes)
+        elif depth == 1:
+            return any(fnmatch(name, model) for model in self.models)
+        elif depth == 2:
+            return name in self.experiments
+        elif depth in (3, 4, 5):
+            return facets[3:] + (name,) in self.tables
+        elif depth == 6:
+            return any(fnmatch(name, ensemble) and (ensemble.startswith('.') or not name.startswith('.'))
+                       for ensemble in self.ensembles)
+        elif depth == 7:
+            return name == LATEST
+        elif depth == 8:
+            return self.variables.get(name) == list(facets[3:6])
+        return True
+
+    def listdir(self, *facets):
+        """
+        Returns the indexed sub-directories of a directory.
+
+        :param str facets: The directory facets from the CMIP5 root folder
+        :returns: The sorted sub-directories names or an empty list if the directory is not indexed
+        :rtype: *list*
+
+        """
+        if facets[:2] not in self.children:
+            if facets and facets[0] not in self.listdir():
+                return []
+            if len(facets) > 1 and facets[1] not in self.listdir(facets[0]):
+                return []
+            self.build(*facets[:2])
+        return self.children.get(facets, [])
+
+    def exists(self, *facets):
+        """
+        Returns True if a directory exists in the index.
+
+        :param str facets: The directory facets from the CMIP5 root folder
+        :returns: True if the directory is indexed
+        :rtype: *boolean*
+
+        """
+        return bool(facets) and facets[-1] in self.listdir(*facets[:-1])
+
+    def path_exists(self, path):
+        """
+        Like :func:`os.path.exists`, but answered from the index for the directories below the CMIP5 root folder
+        matching the requirements.
+
+        :param str path: The path to check
+        :returns: True if the path exists
+        :rtype: *boolean*
+
+        """
+        facets = tuple(os.path.relpath(path, CMIP5).split(os.sep))
+        if facets[0] in (os.curdir, os.pardir) or len(facets) > 9 or \
+                not all(self.match(facets[:i], facets[i]) for i in range(len(facets))):
+            self.metrics.count('stat_calls')
+            return os.path.exists(path)
+        return self.exists(*facets)
+
+
+class AIMDLimiter(object):
+    """
+    Adaptive limit of simultaneous requests upon a host.
+    The limit additively increases by one per window of fast successful requests
+    and is halved on errors or slow responses (at most once per latency target).
+
+    :param int maximum: The maximum number of simultaneous requests
+    :param int minimum: The minimum number of simultaneous requests
+    :param float target: The latency in seconds above which a response is considered slow
+    :returns: The concurrency limiter
+    :rtype: *AIMDLimiter*
+
+    """
+
+    def __init__(self, maximum, minimum=1, target=HTTP_LATENCY_TARGET):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.target = target
+        self.limit = float(max(minimum, maximum // 2))
+        self.in_flight = 0
+        self.decreased = 0
+        self.condition = Condition()
+
+    def acquire(self):
+        """
+        Waits until a request is allowed.
+
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, success, latency):
+        """
+        Ends a request and adapts the limit.
+
+        :param boolean success: True if the request got an answer
+        :param float latency: The request latency in seconds
+
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if success and latency <= self.target:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            elif time.time() - self.decreased > self.target:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.decreased = time.time()
+            self.condition.notify_all()
+
+
+class CircuitBreaker(object):
+    """
+    Stops sending requests to a server after too many consecutive failures.
+    Once open, a single trial request is allowed per cool-down period and a success closes the circuit.
+
+    :param int threshold: The number of consecutive failures opening the circuit
+    :param float cooldown: The time in seconds between trial requests while open
+    :returns: The circuit breaker
+    :rtype: *CircuitBreaker*
+
+    """
+
+    def __init__(self, threshold=CIRCUIT_THRESHOLD, cooldown=CIRCUIT_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self.lock = Lock()
+
+    def allow(self):
+        """
+        Returns True if a request can be sent.
+
+        """
+        with self.lock:
+            if self.opened is None:
+                return True
+            if time.time() - self.opened >= self.cooldown:
+                self.opened = time.time()
+                return True
+            return False
+
+    def success(self):
+        """
+        Records a successful request and closes the circuit.
+
+        """
+        with self.lock:
+            if self.opened is not None:
+                logging.info('THREDDS server is back, circuit closed.')
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        """
+        Records a failed request and opens the circuit beyond the threshold.
+
+        :returns: True if the circuit has just been opened
+        :rtype: *boolean*
+
+        """
+        with self.lock:
+            self.failures += 1
+            if self.opened is None and self.failures >= self.threshold:
+                self.opened = time.time()
+                logging.warning('{0} consecutive THREDDS failures, circuit opened.'.format(self.failures))
+                return True
+            return False
+
+
+class URLProber(object):
+    """
+    Tests aggregation urls through a pool of keep-alive HTTP connections shared between threads.
+    The number of simultaneous requests upon the same host adapts to the observed latency and errors.
+    Transient failures are retried with a jittered exponential backoff. If they persist the url status
+    is unknown (None) rather than missing. After too many consecutive failures, a circuit breaker
+    answers unknown without any request, or aborts the run.
+
+    :param int threads: The maximum number of connections to keep alive
+    :param int host_threads: The maximum number of simultaneous requests per host
+    :param Metrics metrics: The run metrics (optional)
+    :param int retries: The number of retries upon transient failures
+    :param boolean abort: True to abort the run when the circuit breaker opens
+    :returns: The callable url prober
+    :rtype: *URLProber*
+
+    """
+
+    def __init__(self, threads=THREAD_POOL_SIZE, host_threads=HOST_POOL_SIZE, metrics=None,
+                 retries=HTTP_RETRIES, abort=False):
+        self.metrics = metrics or Metrics()
+        self.host_threads = host_threads
+        self.retries = retries
+        self.abort = abort
+        self.breaker = CircuitBreaker()
+        self.hosts = dict()
+        self.lock = Lock()
+        # Deferred imports, requests is only needed to test urls
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=threads, pool_maxsize=threads)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __call__(self, url):
+        limiter = self.get_host_limiter(url)
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                if self.abort:
+                    raise Exception('THREDDS server unavailable')
+                self.metrics.count('circuit_rejections')
+                return None
+            if attempt:
+                self.metrics.count('http_retries')
+                time.sleep(random.uniform(0, HTTP_BACKOFF * 2 ** attempt))
+            limiter.acquire()
+            start = time.time()
+            exists = test_url(url, self.session, self.metrics)
+            limiter.release(exists is not None, time.time() - start)
+            if exists is not None:
+                self.breaker.success()
+                return exists
+            if self.breaker.failure():
+                self.metrics.count('circuit_openings')
+        return None
+
+    def get_host_limiter(self, url):
+        """
+        Returns the limiter throttling the requests upon the url host.
+
+        :param str url: The url to test
+        :returns: The host limiter
+        :rtype: *AIMDLimiter*
+
+        """
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = AIMDLimiter(self.host_threads)
+            return self.hosts[host]
+
+    def close(self):
+        """
+        Closes all pooled connections.
+
+        """
+        self.session.close()
+
+
+class Aggregation(namedtuple('Aggregation', ['institute', 'model', 'experiment', 'frequency', 'realm', 'table',
+                                             'ensemble', 'variable'])):
+    """
+    Identifies an aggregation by its DRS facets and rebuilds its THREDDS url and xml path.
+
+    """
+    __slots__ = ()
+
+    @property
+    def url(self):
+        """
+        The THREDDS aggregation url.
+
+        """
+        return '.'.join([THREDDS_ROOT] + list(self) + [THREDDS_AGGREGATION_HTML_EXT])
+
+    @property
+    def path(self):
+        """
+        The directory where the aggregation data should be.
+
+        """
+        return os.path.join(CMIP5, *(self[:7] + (LATEST, self.variable)))
+
+    @property
+    def xml(self):
+        """
+        The CDAT xml aggregation path.
+
+        """
+        xml_dir = os.path.join(XML_ROOT, *(self[:7] + (LATEST, self.variable)))
+        xml_name = [self.variable, self.table, self.model, self.experiment, self.ensemble]
+        return os.path.join(xml_dir, '{0}{1}'.format('_'.join(xml_name), XML_AGGREGATION_EXT))
+
+
+class ResultStore(object):
+    """
+    Keeps the tests results of the run by aggregation.
+    Each url, xml path, xml content or missing tree is tested at most once whatever the number of readers.
+    Xml files and the files they reference are looked up in the listing of their directory, which is read once.
+
+    Results from previous runs are read from and recorded into the persistent cache if any.
+
+    :param pool pool: The pool of workers running the tests
+    :param URLProber prober: The THREDDS url prober
+    :param ProbeCache cache: The persistent cache of the tests results (optional)
+    :param ThreddsCatalog catalog: The THREDDS catalogs to read before testing urls (optional)
+    :param DRSIndex index: The index answering directories existence (optional)
+    :param Metrics metrics: The run metrics (optional)
+    :returns: The tests results store
+    :rtype: *ResultStore*
+
+    """
+
+    def __init__(self, pool, prober, cache=None, catalog=None, index=None, metrics=None):
+        self.pool = pool
+        self.prober = prober
+        self.cache = cache
+        self.catalog = catalog
+        self.index = index
+        self.metrics = metrics or Metrics()
+        self.results = dict()
+        self.listings = dict()
+
+    def plan(self, aggregations, index):
+        """
+        Records the aggregations whose data directory is missing on disk as missing without testing them,
+        the THREDDS aggregations and the xml files being built from the data.
+
+        :param iter aggregations: The aggregations to test
+        :param DRSIndex index: The index of the CMIP5 tree with the model built
+
+        """
+        tests = ['url', 'xml'] if XML_ROOT == CMIP5 else ['url']
+        for agg in aggregations:
+            if not index.exists(*(agg[:7] + (LATEST, agg.variable))):
+                for test in tests:
+                    if (test, agg) not in self.results:
+                        self.results[(test, agg)] = False
+                        self.metrics.count('tests_planned')
+
+    def get(self, test, aggregations):
+        """
+        Returns the results of a test upon aggregations, running only the missing ones.
+
+        :param str test: The test name, i.e. ``url``, ``xml``, ``cdml`` or ``tree``
+        :param iter aggregations: The aggregations to test
+        :returns: The tests results in the same order as the aggregations
+        :rtype: *list*
+
+        """
+        aggregations = list(aggregations)
+        todo = self.lookup(test, aggregations)
+        self.record(test, todo, self.run(test, todo))
+        return [self.results[(test, agg)] for agg in aggregations]
+
+    def status(self, test, aggregations):
+        """
+        Returns the status of aggregations, testing them only until it is settled.
+        The missing tests are streamed through the pool of workers and the outstanding ones
+        are cancelled as soon as an aggregation exists and another one does not.
+
+        :param str test: The test name, i.e. ``url`` or ``xml``
+        :param iter aggregations: The aggregations to test
+        :returns: The aggregations status
+        :rtype: *str*
+
+        """
+        aggregations = list(aggregations)
+        todo = self.lookup(test, aggregations)
+        results = set(self.results[(test, agg)] for agg in aggregations if (test, agg) in self.results)
+        if todo and not (True in results and False in results):
+            cancelled = Event()
+
+            def probe(agg):
+                if cancelled.is_set():
+                    self.metrics.count('tests_cancelled')
+                    return agg, MISSING
+                return agg, getattr(self, 'test_{0}'.format(test))(agg)
+
+            done = list()
+            for agg, result in self.pool.imap_unordered(probe, todo):
+                done.append((agg, result))
+                results.add(result)
+                if True in results and False in results:
+                    cancelled.set()
+                    break
+            self.record(test, [agg for agg, _ in done], [result for _, result in done])
+        return get_status(list(results))
+
+    def lookup(self, test, aggregations):
+        """
+        Reads the results of aggregations not tested yet from the persistent cache if any.
+
+        :param str test: The test name
+        :param list aggregations: The aggregations
+        :returns: The aggregations to test
+        :rtype: *list*
+
+        """
+        todo = list()
+        for agg in set(aggregations):
+            if (test, agg) in self.results:
+                continue
+            if self.is_cached(test):
+                result = self.cache.get(test, self.get_key(test, agg))
+                if result is not MISSING:
+                    self.results[(test, agg)] = result
+                    self.metrics.count('cache_hits')
+                    continue
+            todo.append(agg)
+        return todo
+
+    def record(self, test, aggregations, results):
+        """
+        Records tests results into the store and the persistent cache if any.
+
+        :param str test: The test name
+        :param list aggregations: The tested aggregations
+        :param list results: The tests results in the same order as the aggregations
+
+        """
+        for agg, result in zip(aggregations, results):
+            self.results[(test, agg)] = result
+        if self.is_cached(test) and aggregations:
+            # Unknown results are not worth remembering beyond the run, but None is an existing tree
+            known = [(agg, result) for agg, result in zip(aggregations, results)
+                     if test == 'tree' or result is not None]
+            self.cache.set(test, [(self.get_key(test, agg), result, is_positive(test, result))
+                                  for agg, result in known])
+
+    def is_cached(self, test):
+        """
+        Returns True if the results of a test are kept in the persistent cache.
+        Xml contents are always checked against the current files.
+
+        """
+        return self.cache is not None and test != 'cdml'
+
+    def run(self, test, aggregations):
+        """
+        Runs a test upon aggregations through the pool of workers.
+        Missing trees are resolved all at once using :func:`get_missing_trees`.
+        Xml directories not yet listed are listed concurrently, each one once.
+
+        :param str test: The test name
+        :param list aggregations: The aggregations to test
+        :returns: The tests results in the same order as the aggregations
+        :rtype: *list*
+
+        """
+        if test == 'tree':
+            trees = get_missing_trees([agg.path for agg in aggregations], self.pool, self.exists)
+            return [trees[os.path.normpath(agg.path)] for agg in aggregations]
+        if test == 'xml':
+            dirs = sorted(set(os.path.dirname(agg.xml) for agg in aggregations) - set(self.listings))
+            self.metrics.count('listdir_calls', len(dirs))
+            self.listings.update(zip(dirs, self.pool.map(list_files, dirs)))
+            return [self.has_xml(agg) for agg in aggregations]
+        if test == 'cdml':
+            return self.pool.map(self.test_cdml, aggregations)
+        return self.pool.map(getattr(self, 'test_{0}'.format(test)), aggregations)
+
+    @staticmethod
+    def get_key(test, aggregation):
+        """
+        Returns the url or path tested for an aggregation.
+
+        :param str test: The test name
+        :param Aggregation aggregation: The tested aggregation
+        :returns: The tested url or path
+        :rtype: *str*
+
+        """
+        return aggregation.xml if test in ['xml', 'cdml'] else aggregation.url
+
+    def urls(self, aggregations):
+        """
+        Returns True for each aggregation available on THREDDS.
+
+        """
+        return self.get('url', aggregations)
+
+    def xmls(self, aggregations):
+        """
+        Returns True for each aggregation with an xml file.
+
+        """
+        return self.get('xml', aggregations)
+
+    def cdmls(self, aggregations):
+        """
+        Returns True for each aggregation whose existing xml file is complete and up to date.
+
+        """
+        return self.get('cdml', aggregations)
+
+    def trees(self, aggregations):
+        """
+        Returns the missing tree of each aggregation, or None if its data exists.
+
+        """
+        return self.get('tree', aggregations)
+
+    def test_url(self, aggregation):
+        """
+        Tests the aggregation url using the THREDDS catalog if any, the prober otherwise.
+
+        """
+        if self.catalog:
+            exists = self.catalog(aggregation)
+            if exists is not None:
+                return exists
+        return self.prober(aggregation.url)
+
+    def test_xml(self, aggregation):
+        """
+        Tests the aggregation xml path, listing its directory if not yet listed.
+
+        """
+        self.list_files(os.path.dirname(aggregation.xml))
+        return self.has_xml(aggregation)
+
+    def has_xml(self, aggregation):
+        """
+        Tests the aggregation xml path against the listing of its directory.
+        A missing directory is listed as None so that its xml files are never looked for.
+
+        """
+        xml_dir, xml_name = os.path.split(aggregation.xml)
+        files = self.listings[xml_dir]
+        return files is not None and xml_name in files
+
+    def test_cdml(self, aggregation):
+        """
+        Tests the aggregation xml content using the listing of the directory of the referenced files.
+
+        """
+        return test_cdml(aggregation.xml, self.list_files)
+
+    def list_files(self, path):
+        """
+        Lists the files of a directory once, the xml directories being usually already listed.
+
+        """
+        if path not in self.listings:
+            self.metrics.count('listdir_calls')
+            self.listings[path] = list_files(path)
+        return self.listings[path]
+
+    def exists(self, path):
+        """
+        Tests if a directory exists using the index if any.
+
+        """
+        if self.index:
+            return self.index.path_exists(path)
+        self.metrics.count('stat_calls')
+        return os.path.exists(path)
+
+
+def is_positive(test, result):
+    """
+    Returns True if a test result means that something exists.
+
+    :param str test: The test name
+    :param object result: The test result
+    :returns: True if the result is positive
+    :rtype: *boolean*
+
+    """
+    if test == 'tree':
+        return result is None
+    return bool(result)
+
+
+def init_worker():
+    """
+    Marks the current thread as a worker of a pool, see :func:`is_worker`.
+
+    """
+    WORKER.pool = True
+
+
+def is_worker():
+    """
+    Returns True if the current thread is a worker of a pool.
+
+    :returns: True if called from a pool worker
+    :rtype: *boolean*
+
+    """
+    return getattr(WORKER, 'pool', False)
+
+
+def list_dirs(path):
+    """
+    Lists the sub-directories of a directory.
+    Entry types come for free from :func:`os.scandir` when available.
+    Otherwise all entries are returned as the DRS only holds directories.
+
+    :param str path: The directory to list
+    :returns: The sub-directories names or an empty list if the path cannot be listed
+    :rtype: *list*
+
+    """
+    try:
+        if scandir:
+            return [entry.name for entry in scandir(path) if entry.is_dir()]
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+def list_files(path):
+    """
+    Like :func:`list_dirs`, but lists the regular files of a directory.
+    Without :func:`os.scandir` all entries are returned to avoid a stat per file.
+
+    :param str path: The directory to list
+    :returns: The files names or None if the path cannot be listed
+    :rtype: *set*
+
+    """
+    try:
+        if scandir:
+            return set(entry.name for entry in scandir(path) if entry.is_file())
+        return set(os.listdir(path))
+    except OSError:
+        return None
+
+
+class ThreddsCatalog(object):
+    """
+    Discovers the aggregations published on THREDDS from the catalog of each model.
+    Every catalog is fetched and parsed once, so that the number of requests does not
+    depend on the number of aggregations.
+
+    :param requests.Session session: The HTTP session to use
+    :param Metrics metrics: The run metrics (optional)
+    :returns: The callable THREDDS catalog
+    :rtype: *ThreddsCatalog*
+
+    """
+
+    def __init__(self, session, metrics=None):
+        self.metrics = metrics or Metrics()
+        self.session = session
+        self.catalogs = dict()
+        self.locks = dict()
+        self.lock = Lock()
+
+    def __call__(self, aggregation):
+        urls = self.get_urls(aggregation.institute, aggregation.model)
+        if urls is None:
+            return None
+        return aggregation.url in urls
+
+    def get_urls(self, institute, model):
+        """
+        Returns the aggregations urls published for a model.
+
+        :param str institute: The institute
+        :param str model: The model
+        :returns: The aggregations urls or None if the catalog is unavailable
+        :rtype: *set*
+
+        """
+        with self.lock:
+            lock = self.locks.setdefault((institute, model), Lock())
+        with lock:
+            if (institute, model) not in self.catalogs:
+                url = THREDDS_CATALOG.format(institute, model)
+                start = time.time()
+                try:
+                    self.catalogs[(institute, model)] = set(read_catalog(url, self.session))
+                except Exception as e:
+                    logging.warning('Catalog {0} unavailable ({1}), urls are tested one by one.'.format(url, e))
+                    self.catalogs[(institute, model)] = None
+                    self.metrics.count('catalog_errors')
+                self.metrics.count('catalog_requests')
+                self.metrics.observe('catalog_latency', time.time() - start)
+            return self.catalogs[(institute, model)]
+
+
+class ModelResult(object):
+    """
+    Collects the results of a model to print and write once the model is processed.
+
+    :param str institute: The institute
+    :param str model: The model
+    :returns: The model results
+    :rtype: *ModelResult*
+
+    """
+
+    def __init__(self, institute, model):
+        self.institute = institute
+        self.model = model
+        self.urls_status = None
+        self.xmls_status = None
+        self.aggregations = list()
+        self.missing = list()
+        self.probes = list()
+
+    def dump(self):
+        """
+        Returns the model results as a JSON serializable dictionary.
+
+        :returns: The model results
+        :rtype: *dict*
+
+        """
+        return dict(vars(self))
+
+    @classmethod
+    def load(cls, data):
+        """
+        Rebuilds model results from :meth:`dump`.
+
+        :param dict data: The dumped model results
+        :returns: The model results
+        :rtype: *ModelResult*
+
+        """
+        result = cls(data['institute'], data['model'])
+        result.urls_status = str(data['urls_status'])
+        result.xmls_status = str(data['xmls_status'])
+        result.aggregations = data['aggregations']
+        result.missing = data['missing']
+        result.probes = data.get('probes', [])
+        return result
 
 
 class ProcessingContext(object):
     """
     Encapsulates the following processing context/information for main process:
 
-    +--------------------+---------------+----------------------------------------+
-    | Attribute          | Type          | Description                            |
-    +====================+===============+========================================+
-    | *self*.ensembles   | *list*        | Ensembles from request                 |
-    +--------------------+---------------+----------------------------------------+
-    | *self*.experiments | *list*        | Experiments from request               |
-    +--------------------+---------------+----------------------------------------+
-    | *self*.institute   | *str*         | Institute in process                   |
-    +--------------------+---------------+----------------------------------------+
-    | *self*.institutes  | *list*        | institutes from a directory            |
-    +--------------------+---------------+----------------------------------------+
-    | *self*.model       | *str*         | Model in process                       |
-    +--------------------+---------------+----------------------------------------+
-    | *self*.agg_file    | *str*         | Output file for available aggregations |
-    +--------------------+---------------+----------------------------------------+
-    | *self*.pool        | *pool object* | Pool of workers (from multithreading)  |
-    +--------------------+---------------+----------------------------------------+
-    | *self*.urls        | *list*        | URLs list to call                      |
-    +--------------------+---------------+----------------------------------------+
-    | *self*.variables   | *list*        | Variables from request                 |
-    +--------------------+---------------+----------------------------------------+
-    | *self*.verbose     | *boolean*     | True if verbose mode                   |
-    +--------------------+---------------+----------------------------------------+
-    | *self*.miss_file   | *boolean*     | True if output missing data            |
-    +--------------------+---------------+----------------------------------------+
+    +----------------------+------------------+-----------------------------------------------+
+    | Attribute            | Type             | Description                                   |
+    +======================+==================+===============================================+
+    | *self*.ensembles     | *list*           | Ensembles from request                        |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.experiments   | *list*           | Experiments from request                      |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.metrics       | *Metrics*        | Run metrics                                   |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.snapshot      | *Snapshot*       | Previous run if incremental mode              |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.journal       | *Journal*        | Completed models if journaled                 |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.index         | *DRSIndex*       | Index of the CMIP5 tree                       |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.institute     | *str*            | Institute in process                          |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.institutes    | *iter*           | institutes from a directory                   |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.model         | *str*            | Model in process                              |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.result        | *ModelResult*    | Results of the model in process               |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.reused        | *boolean*        | True if the model results are reused          |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.agg_file      | *str*            | Output file for available aggregations        |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.agg_writer    | *SortedWriter*   | Writer of the available aggregations          |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.pool          | *pool object*    | Pool of workers (from multithreading)         |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.prober        | *URLProber*      | Pooled HTTP connections to THREDDS            |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.store         | *ResultStore*    | Tests results of the run                      |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.cache         | *ProbeCache*     | Tests results from previous runs              |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.catalog       | *ThreddsCatalog* | THREDDS catalogs if discovery mode            |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.deep          | *boolean*        | True if xml contents are checked              |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.status_only   | *boolean*        | True if only the models status is needed      |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.variables     | *list*           | Variables from request                        |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.verbose       | *boolean*        | True if verbose mode                          |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.template      | *str*            | Template name if batch mode                   |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.matrix        | *StatusMatrix*   | Tests results by facets if exported           |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.matrix_file   | *str*            | Output file for the status matrix             |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.coverage_file | *str*            | Output file for the facets summaries          |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.complete_file | *str*            | Output file for the complete and partial sets |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.max_missing   | *int*            | Variables to give up in partial sets          |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.shard         | *tuple*          | Shard index and number of shards if sharding  |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.results_file  | *str*            | Output file for the models results            |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.results       | *list*           | Models results to write as JSON lines         |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.miss_file     | *boolean*        | True if output missing data                   |
+    +----------------------+------------------+-----------------------------------------------+
+    | *self*.miss_writer   | *SortedWriter*   | Writer of the missing data                    |
+    +----------------------+------------------+-----------------------------------------------+
 
     :param ArgumentParser args: Parsed command-line arguments
     :returns: The processing context
@@ -148,14 +1120,42 @@ class ProcessingContext(object):
         self.ensembles = requirements['ensembles']
         self.experiments = requirements['experiments']
         self.institute = None
-        self.institutes = map(InstituteInfo, os.listdir(CMIP5))
+        self.metrics = Metrics()
+        self.snapshot = get_snapshot(args.incremental, args, requirements) if args.incremental else None
+        self.journal = get_journal(get_journal_file(args), args, requirements)
+        self.pool = ThreadPool(args.threads, initializer=init_worker)
+        self.index = DRSIndex(requirements, self.pool, self.metrics, self.snapshot)
+        self.institutes = (InstituteInfo(name, self.index) for name in self.index.listdir())
         self.model = None
+        self.result = None
+        self.reused = False
         self.agg_file = args.agg
-        self.pool = ThreadPool(THREAD_POOL_SIZE)
-        self.urls = None
+        self.agg_writer = SortedWriter(args.agg) if args.agg else None
+        self.prober = URLProber(args.threads, args.host_threads, self.metrics, args.retries, args.fail_fast)
+        self.cache = None
+        if args.cache:
+            self.cache = ProbeCache(args.cache, max_age=args.max_age, refresh=args.refresh)
+        self.catalog = ThreddsCatalog(self.prober.session, self.metrics) if args.catalog else None
+        self.deep = args.deep
+        self.status_only = args.status_only
+        self.store = ResultStore(self.pool, self.prober, self.cache, self.catalog, self.index, self.metrics)
         self.variables = requirements['variables']
         self.verbose = args.v
+        self.template = None
+        self.matrix_file = args.matrix
+        self.coverage_file = args.coverage
+        self.complete_file = args.complete
+        self.max_missing = args.max_missing
+        self.matrix = get_matrix(args, requirements)
+        self.shard = args.shard
+        self.results_file = get_results_file(args)
+        self.results = list() if self.results_file else None
         self.miss_file = args.miss
+        self.miss_writer = SortedWriter(args.miss) if args.miss else None
+        if self.results_file:
+            # Results lists are collected into the results file
+            self.agg_file = self.agg_file or True
+            self.miss_file = self.miss_file or True
 
 
 def get_args():
@@ -174,6 +1174,9 @@ def get_args():
 
         The default values are displayed next to the corresponding flags.|n|n
 
+        Run "find_agg serve -h" to keep the index and the results in memory.|n
+        Run "find_agg merge -h" to merge the results of shards.|n|n
+
         See full documentation and references on http://prodiguer.github.io/find-agg/.
         """,
         formatter_class=MultilineFormatter,
@@ -185,9 +1188,13 @@ def get_args():
         """)
     parser.add_argument(
         'inputfile',
-        nargs='?',
+        nargs='*',
         type=argparse.FileType('r'),
-        help="""Path of the JSON template with the requirements of the request.""")
+        help="""
+        Path of the JSON template with the requirements of the request.|n
+        Several templates are searched as a batch: each url or path is|n
+        tested once and each template gets its own status table and|n
+        output files, named after the template.""")
     parser.add_argument(
         '--agg',
         nargs='?',
@@ -195,14 +1202,63 @@ def get_args():
         type=str,
         const='{0}/aggregations.list'.format(os.getcwd()),
         help="""
-        Output file with available aggregations list.""")
+        Output file with available aggregations list.|n
+        Gzip compressed if ending with .gz.""")
     parser.add_argument(
         '--miss',
         nargs='?',
         metavar='$PWD/missing_data.list',
         type=str,
         const='{0}/missing_data.list'.format(os.getcwd()),
-        help="""Output file with the list of missing data.""")
+        help="""
+        Output file with the list of missing data.|n
+        Gzip compressed if ending with .gz.""")
+    parser.add_argument(
+        '--metrics',
+        nargs='?',
+        metavar='$PWD/metrics.json',
+        type=str,
+        const='{0}/metrics.json'.format(os.getcwd()),
+        help="""
+        Output file with the run metrics in JSON:|n
+        time per phase and per model, number of HTTP requests|n
+        and filesystem calls, HTTP latency percentiles.""")
+    parser.add_argument(
+        '--prometheus',
+        metavar='PATH',
+        type=str,
+        help="""
+        Output file with the run metrics for the Prometheus|n
+        node exporter textfile collector (.prom).""")
+    parser.add_argument(
+        '--matrix',
+        metavar='PATH',
+        type=str,
+        help="""
+        Output file with the status of every tested aggregation|n
+        by model, experiment, ensemble, variable and endpoint:|n
+        NumPy array (.npz) or Parquet table (.parquet).""")
+    parser.add_argument(
+        '--coverage',
+        metavar='PATH',
+        type=str,
+        help="""
+        Output file with the numbers and fractions of available|n
+        aggregations by model, experiment, ensemble and variable (JSON).""")
+    parser.add_argument(
+        '--complete',
+        metavar='PATH',
+        type=str,
+        help="""
+        Output file with the models and ensembles having all|n
+        the requested aggregations, and the best partial sets|n
+        giving up some variables (JSON).""")
+    parser.add_argument(
+        '--max-missing',
+        metavar='1',
+        type=int,
+        default=1,
+        help="""Maximum number of variables to give up in partial sets.""")
     parser.add_argument(
         '--log',
         metavar='$PWD',
@@ -214,6 +1270,134 @@ def get_args():
         An existing logfile can be submitted.|n
         If not, standard output is used.
         """)
+    parser.add_argument(
+        '--catalog',
+        action='store_true',
+        default=False,
+        help="""
+        Discovers the THREDDS aggregations from the catalog of each model|n
+        instead of testing each url.
+        """)
+    parser.add_argument(
+        '--deep',
+        action='store_true',
+        default=False,
+        help="""
+        Parses the xml aggregations and checks that the files they|n
+        reference are still in the latest directory. Models with a|n
+        truncated or outdated xml aggregation are STALE.
+        """)
+    parser.add_argument(
+        '--status-only',
+        action='store_true',
+        default=False,
+        help="""
+        Only prints the models status: the tests of a model stop as|n
+        soon as its status is settled and no list is generated.|n
+        The results are neither saved nor reused between runs.
+        """)
+    parser.add_argument(
+        '--incremental',
+        metavar='$PWD/findagg.snapshot',
+        type=str,
+        nargs='?',
+        const='{0}/findagg.snapshot'.format(os.getcwd()),
+        help="""
+        Snapshot file of the directories times and models results.|n
+        Only the models with changed directories since the last run|n
+        with the same request are processed again.
+        """)
+    parser.add_argument(
+        '--journal',
+        metavar='$PWD/findagg.journal',
+        type=str,
+        nargs='?',
+        const='{0}/findagg.journal'.format(os.getcwd()),
+        help="""
+        Journal file of the completed models, synced after each|n
+        model and removed once the search completes.
+        """)
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        default=False,
+        help="""
+        Skips the models completed in the journal of an interrupted|n
+        run with the same request and collects their recorded|n
+        results (implies --journal).
+        """)
+    parser.add_argument(
+        '--cache',
+        metavar='$HOME/.findagg/cache.db',
+        type=str,
+        nargs='?',
+        const=os.path.join(os.path.expanduser('~'), '.findagg', 'cache.db'),
+        help="""
+        Cache file of the tests results shared between runs.|n
+        A positive result is trusted for 7 days, a negative one for 1 day.
+        """)
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        default=False,
+        help="""Ignores the cached results and tests everything again.""")
+    parser.add_argument(
+        '--max-age',
+        metavar='SECONDS',
+        type=int,
+        help="""Maximum age of a cached result to use.""")
+    parser.add_argument(
+        '--shard',
+        metavar='i/N',
+        type=get_shard,
+        help="""
+        Processes the i-th of N disjoint parts of the models|n
+        (from 1/N to N/N), chosen by a stable hash of the|n
+        institute and model names. Merge the shards results|n
+        with "find_agg merge".""")
+    parser.add_argument(
+        '--results',
+        metavar='$PWD/results.i-N.json',
+        type=str,
+        help="""
+        Output file with the results of every model (JSON lines),|n
+        written by default when processing a shard.""")
+    parser.add_argument(
+        '--jobs',
+        metavar='1',
+        type=int,
+        default=1,
+        help="""Number of models processed concurrently by each stage.""")
+    parser.add_argument(
+        '--threads',
+        metavar=str(THREAD_POOL_SIZE),
+        type=int,
+        default=THREAD_POOL_SIZE,
+        help="""
+        Number of concurrent tests.|n
+        Also the number of HTTP connections kept alive.
+        """)
+    parser.add_argument(
+        '--host-threads',
+        metavar=str(HOST_POOL_SIZE),
+        type=int,
+        default=HOST_POOL_SIZE,
+        help="""
+        Maximum number of concurrent HTTP requests per host.|n
+        The actual number adapts to the server latency and errors.""")
+    parser.add_argument(
+        '--retries',
+        metavar=str(HTTP_RETRIES),
+        type=int,
+        default=HTTP_RETRIES,
+        help="""Number of retries upon HTTP timeouts or server errors.""")
+    parser.add_argument(
+        '--fail-fast',
+        action='store_true',
+        default=False,
+        help="""
+        Aborts the run if the THREDDS server looks down.|n
+        Otherwise, the OpenDAP status is UNKNOWN.""")
     parser.add_argument(
         '-v',
         action='store_true',
@@ -231,6 +1415,41 @@ def get_args():
     return parser.parse_args()
 
 
+def get_shard(value):
+    """
+    Parses the ``--shard`` option.
+
+    :param str value: The option value, i.e. ``i/N``
+    :returns: The shard index (from 1) and the number of shards
+    :rtype: *tuple*
+    :raises Error: If the value is not a valid shard
+
+    """
+    try:
+        index, count = [int(number) for number in value.split('/')]
+        assert 1 <= index <= count
+        return index, count
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError('{0} is not a valid shard, i.e. i/N with 1 <= i <= N'.format(value))
+
+
+def in_shard(shard, institute, model):
+    """
+    Returns True if a model belongs to a shard, using a hash stable between runs and hosts.
+
+    :param tuple shard: The shard index (from 1) and the number of shards, None for no sharding
+    :param str institute: The institute
+    :param str model: The model
+    :returns: True if the model has to be processed
+    :rtype: *boolean*
+
+    """
+    if shard is None:
+        return True
+    digest = hashlib.md5('{0}/{1}'.format(institute, model).encode('utf-8')).hexdigest()
+    return int(digest, 16) % shard[1] == shard[0] - 1
+
+
 def init_logging(log, level='INFO'):
     """
     Initiates the logging configuration (output, date/message formatting).
@@ -275,21 +1494,24 @@ def get_requirements(path):
     """
     Loads the requirements from the JSON template.
 
-    :param str path: The path of the JSON file with requirements
+    :param file path: The JSON file with requirements
     :returns: The user requirements
     :rtype: *json*
     :raises Error: If the JSON file parsing fails
+    :raises Error: If the requirements are invalid
 
     """
     try:
-        return validate_requirements(load(path))
-    except:
-        raise Exception('{0} is not a valid JSON file'.format(path))
+        requirements = load(path)
+    except ValueError as e:
+        raise Exception('{0} is not a valid JSON file ({1})'.format(getattr(path, 'name', path), e))
+    return validate_requirements(requirements)
 
 
 def validate_requirements(json):
     """
     Validate the requirements against the JSON schema.
+    Every error is reported with the path of the invalid item.
 
     :param json json: The JSON data to validate
     :returns: The validated JSON data
@@ -297,106 +1519,195 @@ def validate_requirements(json):
     :raises Error: If the JSON file is invalid
 
     """
-    with open('{0}/template.json'.format(os.path.dirname(os.path.abspath(__file__)))) as f:
-        schema = load(f)
-    try:
-        validate(json, schema)
-        return json
-    except:
-        raise Exception('Requirements have invalid format')
+    errors = sorted(get_validator().iter_errors(json), key=lambda error: [str(item) for item in error.path])
+    if errors:
+        raise Exception('Requirements have invalid format:\n{0}'.format('\n'.join(
+            ' * {0}: {1}'.format('/'.join(str(item) for item in error.path) or '(root)', error.message)
+            for error in errors)))
+    return json
 
 
-def get_ensembles_list(ctx):
+def get_validator():
     """
-    Returns the ensembles list given an institute and a model.
+    Returns the requirements validator, compiled from the JSON schema upon first call.
 
-    :param ProcessingContext ctx: The processing context
-    :returns: The ensembles list without duplicates
-    :rtype: *list*
+    :returns: The JSON schema validator
+    :rtype: *jsonschema.IValidator*
 
     """
-    ensembles = []
-    for experiment in ctx.experiments:
-        for variable in ctx.variables:
-            path = list()
-            path.append(CMIP5)
-            path.append(ctx.institute.name)
-            path.append(ctx.model)
-            path.append(experiment)
-            path += ctx.variables[variable]
-            for ensemble in ctx.ensembles:
-                ensembles += [os.path.basename(p) for p in glob('/'.join(path) + '/' + ensemble)]
-    return list(set(ensembles))
+    global VALIDATOR
+    if VALIDATOR is None:
+        # Deferred import, jsonschema is only needed to read requirements
+        from jsonschema.validators import validator_for
+        with open('{0}/template.json'.format(os.path.dirname(os.path.abspath(__file__)))) as f:
+            schema = load(f)
+        validator = validator_for(schema)
+        validator.check_schema(schema)
+        VALIDATOR = validator(schema)
+    return VALIDATOR
 
 
-def get_aggregation_urls(ctx):
+def get_ensembles_list(ctx):
     """
-    Yields the aggregations urls for testing.
+    Returns the ensembles list given an institute and a model.
 
     :param ProcessingContext ctx: The processing context
-    :returns: An iterator on rebuild urls
-    :rtype: *iter*
+    :returns: The ensembles list without duplicates
+    :rtype: *list*
 
     """
-    for experiment, ensemble in product(ctx.experiments, get_ensembles_list(ctx)):
+    ensembles = set()
+    for experiment in ctx.experiments:
         for variable in ctx.variables:
-            url = [THREDDS_ROOT, ctx.institute.name, ctx.model, experiment]
-            url += ctx.variables[variable]
-            url.append(ensemble)
-            url.append(variable)
-            url.append(THREDDS_AGGREGATION_HTML_EXT)
-            yield '.'.join(url)
+            ensembles.update(ctx.index.listdir(ctx.institute.name, ctx.model, experiment, *ctx.variables[variable]))
+    return list(ensembles)
 
 
-def get_aggregation_xmls(ctx):
+def get_aggregations(ctx):
     """
-    Like :func:`get_aggregation_urls`, but returns an iterator on rebuild xml paths.
+    Yields the aggregations to test given an institute and a model.
 
     :param ProcessingContext ctx: The processing context
-    :returns: An iterator on rebuild xml paths
+    :returns: An iterator on aggregations
     :rtype: *iter*
 
     """
     for experiment, ensemble in product(ctx.experiments, get_ensembles_list(ctx)):
         for variable in ctx.variables:
-            xml_dir = [XML_ROOT, ctx.institute.name, ctx.model, experiment]
-            xml_dir += ctx.variables[variable]
-            xml_dir.append(ensemble)
-            xml_dir.append(LATEST)
-            xml_dir.append(variable)
-            xml_dir = os.path.join(*xml_dir)
-            xml_name = [variable, ctx.variables[variable][2], ctx.model, experiment, ensemble]
-            xml_name = '{0}{1}'.format('_'.join(xml_name), XML_AGGREGATION_EXT)
-            yield os.path.join(xml_dir, xml_name)
+            frequency, realm, table = ctx.variables[variable]
+            yield Aggregation(ctx.institute.name, ctx.model, experiment, frequency, realm, table, ensemble, variable)
 
 
-def test_url(url):
+def test_url(url, session=None, metrics=None):
     """
     Tests an url response.
 
     :param str url: The url to test
-    :returns: True if the aggregation url exists
+    :param requests.Session session: The HTTP session to use (a new connection by default)
+    :param Metrics metrics: The run metrics recording requests, errors and latency (optional)
+    :returns: True if the aggregation url exists, False if not, None if unknown because of a transient failure
     :rtype: *boolean*
-    :raises Error: If an HTTP request fails
 
     """
+    import requests
+    session = session or requests
+    start = time.time()
     try:
-        r = requests.head(url, timeout=1)
+        r = session.head(url, timeout=HTTP_TIMEOUT)
+        if r.status_code in HTTP_TRANSIENT_CODES:
+            if metrics:
+                metrics.count('http_errors')
+            return None
         return r.status_code == requests.codes.ok
+    except requests.exceptions.Timeout:
+        if metrics:
+            metrics.count('http_timeouts')
+        return None
     except:
-        return False
+        if metrics:
+            metrics.count('http_errors')
+        return None
+    finally:
+        if metrics:
+            metrics.count('http_requests')
+            metrics.observe('http_latency', time.time() - start)
 
 
-def test_xml(xml):
+def read_catalog(url, session=None, visited=None):
     """
-    Like :func:`test_url`, but tests if an xml path exists.
+    Yields the OpenDAP aggregations urls from a THREDDS catalog and the catalogs it references.
+    The XML is parsed while it is downloaded and elements are freed as soon as read.
+
+    :param str url: The catalog url
+    :param requests.Session session: The HTTP session to use (a new connection by default)
+    :param set visited: The catalogs already read
+    :returns: An iterator on aggregations urls
+    :rtype: *iter*
+    :raises Error: If the catalog cannot be downloaded or parsed
+
+    """
+    if session is None:
+        import requests
+        session = requests
+    if visited is None:
+        visited = set()
+    visited.add(url)
+    dods = THREDDS_ROOT.rsplit('/', 1)[0]
+    suffix = os.path.splitext(THREDDS_AGGREGATION_HTML_EXT)[0]
+    references = list()
+    r = session.get(url, timeout=CATALOG_TIMEOUT, stream=True)
+    r.raise_for_status()
+    r.raw.decode_content = True
+    for _, element in iterparse(r.raw):
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'dataset' and element.get('urlPath', '').endswith(suffix):
+            yield '{0}/{1}.html'.format(dods, element.get('urlPath'))
+        elif tag == 'catalogRef':
+            references.append(urljoin(url, element.get(XLINK_HREF)))
+        element.clear()
+    for reference in references:
+        if reference not in visited:
+            for aggregation in read_catalog(reference, session, visited):
+                yield aggregation
+
+
+def test_cdml(xml, listdir=list_files):
+    """
+    Tests if an existing xml aggregation is complete and up to date.
+    The xml is parsed in a streaming fashion and elements are freed as soon as read, so that
+    the memory does not depend on the number of referenced files. The files of the aggregation
+    file map are looked up in a single listing of the aggregation directory.
 
     :param str xml: The xml path to test
-    :returns: True if the xml aggregation exists
+    :param function listdir: The function listing the files of a directory
+    :returns: False if the xml is truncated or references a missing file
     :rtype: *boolean*
 
     """
-    return os.path.isfile(xml)
+    depth = 0
+    try:
+        events = iterparse(xml, events=('start', 'end'))
+        _, root = next(events)
+        directory = os.path.normpath(os.path.join(os.path.dirname(xml), root.get('directory', '')))
+        filemap = root.get('cdms_filemap')
+        for event, element in events:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            element.clear()
+            if depth == 0:
+                # Drop the elements read from the dataset
+                root.clear()
+    except (SyntaxError, StopIteration):
+        # Truncated or empty xml file
+        return False
+    files = listdir(directory)
+    if not filemap or files is None:
+        return False
+    return all(match.group(1) in files for match in XML_AGGREGATION_FILE.finditer(filemap))
+
+
+def get_status(results):
+    """
+    Returns the aggregation status from a list of tests results.
+    Unknown results (None) lead to an unknown status unless the known ones are enough to conclude.
+
+    :param list results: The tests results
+    :returns: The aggregation status
+    :rtype: *str*
+
+    """
+    if None in results:
+        if True in results and False in results:
+            return INCOMPLETE
+        return UNKNOWN
+    elif not any(results):
+        return NONE
+    elif all(results):
+        return COMPLETE
+    else:
+        return INCOMPLETE
 
 
 def all_urls_exist(ctx):
@@ -408,133 +1719,596 @@ def all_urls_exist(ctx):
     :rtype: *boolean*
 
     """
-    urls = ctx.pool.map(test_url, get_aggregation_urls(ctx))
-    if not any(urls):
-        return NONE
-    elif all(urls):
-        return COMPLETE
-    else:
-        return INCOMPLETE
+    aggregations = list(get_aggregations(ctx))
+    if ctx.status_only:
+        return ctx.store.status('url', aggregations)
+    results = ctx.store.urls(aggregations)
+    add_probes(ctx, 'opendap', aggregations, results)
+    return get_status(results)
 
 
 def all_xmls_exist(ctx):
     """
     Like :func:`all_urls_exist`, but returns a flag indicating whether all xml paths exist or not.
+    In deep mode, a model with a stale xml aggregation is ``STALE``.
 
     :param ProcessingContext ctx: The processing context
     :returns: True if all xml aggregation exist
     :rtype: *boolean*
 
     """
-    xmls = ctx.pool.map(test_xml, get_aggregation_xmls(ctx))
-    if not any(xmls):
-        return NONE
-    elif all(xmls):
-        return COMPLETE
-    else:
-        return INCOMPLETE
+    aggregations = list(get_aggregations(ctx))
+    if ctx.status_only and not ctx.deep:
+        return ctx.store.status('xml', aggregations)
+    results = get_xmls(ctx, aggregations)
+    add_probes(ctx, 'cdat', aggregations, results)
+    if STALE in results:
+        return STALE
+    return get_status(results)
+
+
+def get_xmls(ctx, aggregations):
+    """
+    Tests if the xml aggregations exist and, in deep mode, if the existing ones are up to date.
+
+    :param ProcessingContext ctx: The processing context
+    :param list aggregations: The aggregations
+    :returns: True if the xml aggregation is available, False if missing, ``STALE`` if not up to date
+    :rtype: *list*
+
+    """
+    results = ctx.store.xmls(aggregations)
+    if ctx.deep:
+        existing = [agg for agg, exists in zip(aggregations, results) if exists]
+        valid = dict(zip(existing, ctx.store.cdmls(existing)))
+        results = [STALE if exists and not valid[agg] else exists for agg, exists in zip(aggregations, results)]
+    return results
+
+
+def add_probes(ctx, endpoint, aggregations, results):
+    """
+    Keeps the tests results of the model for the status matrix, if any.
+
+    :param ProcessingContext ctx: The processing context
+    :param str endpoint: The tested endpoint, i.e. ``opendap`` or ``cdat``
+    :param list aggregations: The tested aggregations
+    :param list results: The tests results
+
+    """
+    if ctx.matrix:
+        # A stale xml aggregation is not available
+        ctx.result.probes.extend((endpoint, agg.experiment, agg.ensemble, agg.variable,
+                                  False if result == STALE else result)
+                                 for agg, result in zip(aggregations, results))
 
 
 def write_urls(ctx):
     """
-    Writes all available aggregations into output file.
+    Writes all available aggregations into the model results.
 
     :param ProcessingContext ctx: The processing context
 
     """
     if ctx.agg_file:
-        with open(ctx.agg_file, 'a+') as f:
-            for url in get_aggregation_urls(ctx):
-                f.write('{0}\n'.format(url.replace('.html', '')))
+        aggregations = list(get_aggregations(ctx))
+        for aggregation, exists in zip(aggregations, ctx.store.urls(aggregations)):
+            if exists:
+                ctx.result.aggregations.append(aggregation.url.replace('.html', ''))
 
 
 def write_xmls(ctx):
     """
-    Like :func:`write_urls`, but writes available xml paths into the output file.
+    Like :func:`write_urls`, but writes available xml paths into the model results.
 
     :param ProcessingContext ctx: The processing context
 
     """
     if ctx.agg_file:
-        with open(ctx.agg_file, 'a+') as f:
-            for xml in get_aggregation_xmls(ctx):
-                f.write('{0}\n'.format(xml))
+        aggregations = list(get_aggregations(ctx))
+        for aggregation, exists in zip(aggregations, get_xmls(ctx, aggregations)):
+            if exists is True:
+                ctx.result.aggregations.append(aggregation.xml)
+
+
+def get_missing_trees(paths, pool=None, exists=os.path.exists):
+    """
+    Returns the master missing tree where the data of each path should be.
+    The paths are gathered into a prefix trie resolved top-down, one level at a time.
+    A directory shared by several paths is checked once and the children of a missing directory are never checked.
+
+    :param list paths: The absolute paths where data should be
+    :param pool pool: The pool of workers checking the directories of a level (optional)
+    :param function exists: The function checking if a path exists
+    :returns: The child tree where data should be for each normalized path, None if the path exists
+    :rtype: *dict*
+
+    """
+    trie = dict()
+    for path in paths:
+        node = trie
+        for name in os.path.normpath(path).strip(os.sep).split(os.sep):
+            node = node.setdefault(name, dict())
+    trees = dict()
+    level = [(os.sep, trie)]
+    while level:
+        children = [(os.path.join(parent, name), child) for parent, node in level for name, child in node.items()]
+        paths = [path for path, _ in children]
+        found = pool.map(exists, paths) if pool else map(exists, paths)
+        level = list()
+        for (path, node), exist in zip(children, found):
+            if exist and node:
+                level.append((path, node))
+            elif exist:
+                trees[path] = None
+            else:
+                # Every path below a missing directory shares it as missing tree
+                leaves = [(path, node)]
+                while leaves:
+                    leaf, node = leaves.pop()
+                    if node:
+                        leaves.extend((os.path.join(leaf, name), child) for name, child in node.items())
+                    else:
+                        trees[leaf] = path
+    return trees
+
+
+def get_missing_data(ctx):
+    """
+    Writes the sorted list of missing data into the model results.
+
+    :param ProcessingContext ctx: The processing context
+
+    """
+    if ctx.miss_file:
+        data = filter(lambda m: m is not None, ctx.store.trees(get_aggregations(ctx)))
+        ctx.result.missing.extend(data)
+
+
+def get_missing_urls(ctx):
+    """
+    Like :func:`get_missing_data`, but writes the sorted list of missing aggregations urls.
+
+    :param ProcessingContext ctx: The processing context
+
+    """
+    if ctx.miss_file:
+        aggregations = list(get_aggregations(ctx))
+        urls = [agg.url for agg, exists in zip(aggregations, ctx.store.urls(aggregations)) if exists is False]
+        ctx.result.missing.extend(urls)
+
+
+def get_missing_xmls(ctx):
+    """
+    Like :func:`get_missing_urls`, but writes the sorted list of missing or stale xml paths.
+
+    :param ProcessingContext ctx: The processing context
+
+    """
+    if ctx.miss_file:
+        aggregations = list(get_aggregations(ctx))
+        xmls = [agg.xml for agg, exists in zip(aggregations, get_xmls(ctx, aggregations)) if exists is not True]
+        ctx.result.missing.extend(xmls)
+
+
+def get_request_context(ctx, requirements):
+    """
+    Returns a copy of the processing context dedicated to other requirements.
+    The copy shares the workers, the HTTP connections and the tests results, but has its own index and no output writer.
+
+    :param ProcessingContext ctx: The processing context
+    :param dict requirements: The user requirements
+    :returns: The request processing context
+    :rtype: *ProcessingContext*
+
+    """
+    ctx = copy(ctx)
+    ctx.ensembles = requirements['ensembles']
+    ctx.experiments = requirements['experiments']
+    ctx.variables = requirements['variables']
+    ctx.snapshot = None
+    ctx.journal = None
+    ctx.matrix = None
+    ctx.index = DRSIndex(requirements, ctx.pool, ctx.metrics, listings=ctx.index.listings)
+    ctx.institutes = (InstituteInfo(name, ctx.index) for name in ctx.index.listdir())
+    ctx.agg_writer = ctx.miss_writer = None
+    return ctx
+
+
+def get_template_context(ctx, args, template, requirements):
+    """
+    Returns a copy of the processing context dedicated to a template of a batch, with its own output files.
+    The output files are named after the template, see :func:`get_template_file`.
 
+    :param ProcessingContext ctx: The processing context of the batch
+    :param ArgumentParser args: Parsed command-line arguments
+    :param str template: The template name
+    :param dict requirements: The user requirements of the template
+    :returns: The template processing context
+    :rtype: *ProcessingContext*
 
-def url2path(url):
     """
-    Converts an aggregation url into a file path.
+    ctx = get_request_context(ctx, requirements)
+    ctx.template = template
+    ctx.agg_file = get_template_file(args.agg, template)
+    ctx.agg_writer = SortedWriter(ctx.agg_file) if ctx.agg_file else None
+    ctx.miss_file = get_template_file(args.miss, template)
+    ctx.miss_writer = SortedWriter(ctx.miss_file) if ctx.miss_file else None
+    ctx.matrix_file = get_template_file(args.matrix, template)
+    ctx.coverage_file = get_template_file(args.coverage, template)
+    ctx.complete_file = get_template_file(args.complete, template)
+    ctx.results_file = get_template_file(get_results_file(args), template)
+    ctx.results = list() if ctx.results_file else None
+    if ctx.results_file:
+        ctx.agg_file = ctx.agg_file or True
+        ctx.miss_file = ctx.miss_file or True
+    ctx.matrix = get_matrix(args, requirements)
+    if args.incremental:
+        ctx.snapshot = get_snapshot(get_template_file(args.incremental, template), args, requirements)
+        ctx.index = DRSIndex(requirements, ctx.pool, ctx.metrics, ctx.snapshot)
+        ctx.institutes = (InstituteInfo(name, ctx.index) for name in ctx.index.listdir())
+    # The tests results are shared with the batch, but directories are looked up in the index built for each model
+    ctx.store = copy(ctx.store)
+    ctx.store.index = ctx.index
+    ctx.journal = get_journal(get_template_file(get_journal_file(args), template), args, requirements)
+    return ctx
+
+
+def get_template_file(path, template):
+    """
+    Returns the output file of a template of a batch, i.e. the template name inserted before the extensions
+    (e.g., ``aggregations.list.gz`` becomes ``aggregations.<template>.list.gz``).
 
-    :param str url: The url to convert
-    :returns: The corresponding path on filesystem
+    :param str path: The output file of the run
+    :param str template: The template name
+    :returns: The output file of the template or None if no output file
     :rtype: *str*
 
     """
-    path = [CMIP5]
-    path.extend(url.split('.')[5:12])
-    path.append(LATEST)
-    path.append(url.split('.')[12])
-    return os.path.join(*path)
+    if not path:
+        return None
+    directory, name = os.path.split(path)
+    name, sep, extensions = name.partition('.')
+    return os.path.join(directory, '{0}.{1}{2}{3}'.format(name, template, sep, extensions))
+
+
+def get_batch_requirements(requirements):
+    """
+    Merges the requirements of a batch, so that one index answers the existence of all their directories.
+
+    :param list requirements: The user requirements of each template
+    :returns: The union of the requirements
+    :rtype: *dict*
+
+    """
+    union = {'ensembles': set(), 'experiments': set(), 'variables': dict(), 'institutes': set(), 'models': set()}
+    for request in requirements:
+        union['ensembles'].update(request['ensembles'])
+        union['experiments'].update(request['experiments'])
+        union['variables'].update(request['variables'])
+        union['institutes'].update(request.get('institutes', ['*']))
+        union['models'].update(request.get('models', ['*']))
+    return dict((key, value if isinstance(value, dict) else sorted(value)) for key, value in union.items())
 
 
-def get_missing_tree(url):
+def get_results_file(args):
     """
-    Returns the master missing tree where the data should be.
+    Returns the output file of the models results, by default ``$PWD/results.i-N.json`` for a shard.
 
-    :param str url: The url to convert using :func:`url2path`
-    :returns: The child tree where data should be on the filesystem
+    :param ArgumentParser args: Parsed command-line arguments
+    :returns: The output file or None
     :rtype: *str*
 
     """
-    path = url2path(url)
-    if not os.path.exists(path):
-        child = path
-        while not os.path.exists(path):
-            child = path
-            path = os.path.dirname(path)
-        return child
+    if args.results or not args.shard:
+        return args.results
+    return os.path.join(os.getcwd(), 'results.{0}-{1}.json'.format(*args.shard))
 
 
-def get_missing_data(ctx):
+def write_results(ctx, requirements):
     """
-    Writes the sorted list of missing data.
+    Writes the models results as JSON lines, the first line describing the request and the shard.
+    The request includes the roots and options changing the results so that shards of different runs are not merged.
+    See :mod:`findagg.merge`.
 
     :param ProcessingContext ctx: The processing context
+    :param dict requirements: The user requirements
 
     """
-    data = filter(lambda m: m is not None, ctx.pool.map(get_missing_tree, get_aggregation_urls(ctx)))
-    for data in set(sorted(data)):
-        if ctx.miss_file:
-            with open(ctx.miss_file, 'a+') as f:
-                f.write('{0}\n'.format(data))
+    header = {'requirements': requirements,
+              'root': CMIP5,
+              'xml_root': XML_ROOT,
+              'thredds': THREDDS_ROOT,
+              'deep': bool(ctx.deep),
+              'catalog': bool(ctx.catalog),
+              'probes': bool(ctx.matrix),
+              'shard': ctx.shard or [1, 1]}
+    lines = [json.dumps(header, sort_keys=True)]
+    lines.extend(json.dumps(result.dump(), sort_keys=True) for result in ctx.results)
+    write_atomically(ctx.results_file, '\n'.join(lines) + '\n')
+
+
+def get_matrix(args, requirements):
+    """
+    Returns an empty status matrix if it has to be exported.
 
+    :param ArgumentParser args: Parsed command-line arguments
+    :param dict requirements: The user requirements
+    :returns: The status matrix or None
+    :rtype: *StatusMatrix*
 
-def get_missing_urls(ctx):
     """
-    Like :func:`get_missing_data`, but writes the sorted list of missing aggregations urls.
+    if args.matrix:
+        check_format(args.matrix)
+    if args.matrix or args.coverage or args.complete:
+        return StatusMatrix(requirements['experiments'], requirements['variables'])
+    return None
+
+
+def get_request(args, requirements):
+    """
+    Returns what identifies a request between runs, i.e. the requirements, CMIP5 root, THREDDS server and outputs.
+
+    :param ArgumentParser args: Parsed command-line arguments
+    :param dict requirements: The user requirements
+    :returns: The JSON serializable request
+    :rtype: *dict*
+
+    """
+    request = {'requirements': requirements,
+               'root': CMIP5,
+               'thredds': THREDDS_ROOT,
+               'outputs': [bool(args.agg), bool(args.miss), bool(args.matrix or args.coverage or args.complete),
+                           bool(get_results_file(args))]}
+    if args.deep:
+        request['deep'] = True
+    if args.status_only:
+        request['status_only'] = True
+    return request
+
+
+def get_snapshot(path, args, requirements):
+    """
+    Returns the snapshot of the previous run with the same request.
+
+    :param str path: The snapshot file
+    :param ArgumentParser args: Parsed command-line arguments
+    :param dict requirements: The user requirements
+    :returns: The snapshot
+    :rtype: *Snapshot*
+
+    """
+    return Snapshot(path, get_request(args, requirements))
+
+
+def get_journal_file(args):
+    """
+    Returns the journal file, by default ``$PWD/findagg.journal`` when resuming.
+
+    :param ArgumentParser args: Parsed command-line arguments
+    :returns: The journal file or None
+    :rtype: *str*
+
+    """
+    if args.journal or not args.resume:
+        return args.journal
+    return os.path.join(os.getcwd(), 'findagg.journal')
+
+
+def get_journal(path, args, requirements):
+    """
+    Returns the journal of the run, resuming the interrupted run with the same request and shard if required.
+
+    :param str path: The journal file, None for no journal
+    :param ArgumentParser args: Parsed command-line arguments
+    :param dict requirements: The user requirements
+    :returns: The journal
+    :rtype: *Journal*
+
+    """
+    if not path:
+        return None
+    return Journal(path, dict(get_request(args, requirements), shard=args.shard), args.resume)
+
+
+def get_model_context(ctx, institute, model):
+    """
+    Returns a copy of the processing context dedicated to a model, so that models can be processed concurrently.
 
     :param ProcessingContext ctx: The processing context
+    :param InstituteInfo institute: The institute of the model
+    :param str model: The model to process
+    :returns: The model processing context
+    :rtype: *ProcessingContext*
 
     """
-    urls = ifilterfalse(test_url, get_aggregation_urls(ctx))
-    for url in set(sorted(urls)):
-        if ctx.miss_file:
-            with open(ctx.miss_file, 'a+') as f:
-                f.write('{0}\n'.format(url))
+    ctx = copy(ctx)
+    ctx.institute = institute
+    ctx.model = model
+    ctx.result = ModelResult(institute.name, model)
+    ctx.reused = False
+    return ctx
 
 
-def get_missing_xmls(ctx):
+def process_model(ctx, institute, model):
+    """
+    Searches the aggregations of a model using its own processing context, running the stages of :func:`search` in turn.
+
+    :param ProcessingContext ctx: The processing context
+    :param InstituteInfo institute: The institute of the model
+    :param str model: The model to process
+    :returns: The model results
+    :rtype: *ModelResult*
+
+    """
+    return list_model(probe_urls(probe_xmls(index_model(ctx, institute, model))))
+
+
+def index_model(ctx, institute, model):
+    """
+    Indexes the directories of a model and classifies its aggregations without data on disk.
+    In incremental mode, the previous results of an unchanged model are reused.
+    When resuming, the results of a model completed by the interrupted run are reused.
+
+    :param ProcessingContext ctx: The processing context
+    :param InstituteInfo institute: The institute of the model
+    :param str model: The model to process
+    :returns: The model processing context
+    :rtype: *ProcessingContext*
+
     """
-    Like :func:`get_missing_urls`, but writes the sorted list of missing xml paths.
+    if ctx.journal and ctx.journal.is_completed(institute.name, model):
+        ctx.metrics.count('models_resumed')
+        if ctx.snapshot:
+            # The snapshot keeps the directories of every model
+            ctx.index.build(institute.name, model)
+        return get_reused_context(ctx, institute, model, ctx.journal.get_result(institute.name, model))
+    with ctx.metrics.phase('index', institute.name, model):
+        ctx.index.build(institute.name, model)
+    if ctx.snapshot and not ctx.snapshot.is_changed(institute.name, model):
+        result = ctx.snapshot.get_result(institute.name, model)
+        if UNKNOWN not in (result['urls_status'], result['xmls_status']):
+            ctx.metrics.count('models_reused')
+            return get_reused_context(ctx, institute, model, result)
+    ctx = get_model_context(ctx, institute, model)
+    with ctx.metrics.phase('plan', institute.name, model):
+        ctx.store.plan(get_aggregations(ctx), ctx.index)
+    return ctx
+
+
+def get_reused_context(ctx, institute, model, result):
+    """
+    Returns the processing context of a model whose results are reused, the next stages being skipped.
 
     :param ProcessingContext ctx: The processing context
+    :param InstituteInfo institute: The institute of the model
+    :param str model: The model
+    :param dict result: The dumped model results
+    :returns: The model processing context
+    :rtype: *ProcessingContext*
 
     """
-    xmls = ifilterfalse(test_xml, get_aggregation_xmls(ctx))
-    for xml in set(sorted(xmls)):
-        if ctx.miss_file:
-            with open(ctx.miss_file, 'a+') as f:
-                f.write('{0}\n'.format(xml))
+    ctx = get_model_context(ctx, institute, model)
+    ctx.result = ModelResult.load(result)
+    ctx.reused = True
+    return ctx
+
+
+def probe_xmls(ctx):
+    """
+    Tests the xml aggregations of a model on the filesystem.
+
+    :param ProcessingContext ctx: The model processing context
+    :returns: The model processing context
+    :rtype: *ProcessingContext*
+
+    """
+    if not ctx.reused:
+        with ctx.metrics.phase('xmls', ctx.institute.name, ctx.model):
+            ctx.result.xmls_status = all_xmls_exist(ctx)
+    return ctx
+
+
+def probe_urls(ctx):
+    """
+    Tests the THREDDS aggregations of a model over HTTP.
+
+    :param ProcessingContext ctx: The model processing context
+    :returns: The model processing context
+    :rtype: *ProcessingContext*
+
+    """
+    if not ctx.reused:
+        with ctx.metrics.phase('urls', ctx.institute.name, ctx.model):
+            ctx.result.urls_status = all_urls_exist(ctx)
+    return ctx
+
+
+def list_model(ctx):
+    """
+    Lists the available aggregations and the missing ones and data of a model, then journals its results.
+
+    :param ProcessingContext ctx: The model processing context
+    :returns: The model results
+    :rtype: *ModelResult*
+
+    """
+    if not ctx.reused and not ctx.status_only:
+        with ctx.metrics.phase('lists', ctx.institute.name, ctx.model):
+            if ctx.result.urls_status is COMPLETE:
+                write_urls(ctx)
+            else:
+                get_missing_urls(ctx)
+            if ctx.result.xmls_status is COMPLETE:
+                write_xmls(ctx)
+            else:
+                get_missing_xmls(ctx)
+        with ctx.metrics.phase('trees', ctx.institute.name, ctx.model):
+            if ctx.result.urls_status is not COMPLETE or ctx.result.xmls_status is not COMPLETE:
+                get_missing_data(ctx)
+    return journal_model(ctx, ctx.result)
+
+
+def search(ctx, jobs):
+    """
+    Processes the models through a pipeline of stages running concurrently: the institutes and models
+    discovery, their indexing, the xml tests on the filesystem, the url tests over HTTP and the lists.
+    While a model is tested over HTTP, the next ones are indexed and the previous ones are listed and collected.
+
+    :param ProcessingContext ctx: The processing context
+    :param int jobs: The number of models processed concurrently by each stage
+    :returns: The models results in the institutes/models order
+    :rtype: *iter*
+
+    """
+    units = ((institute, model) for institute in ctx.institutes for model in institute.models
+             if in_shard(ctx.shard, institute.name, model))
+    stages = [lambda unit: index_model(ctx, *unit), probe_xmls, probe_urls, list_model]
+    return Pipeline(stages, jobs).imap(units)
+
+
+def journal_model(ctx, result):
+    """
+    Records the results of a completed model into the journal, unless a test failed transiently.
+
+    :param ProcessingContext ctx: The processing context
+    :param ModelResult result: The model results
+    :returns: The model results
+    :rtype: *ModelResult*
+
+    """
+    if ctx.journal and UNKNOWN not in (result.urls_status, result.xmls_status):
+        ctx.journal.set_result(result.institute, result.model, result.dump())
+    return result
+
+
+def log_header():
+    """
+    Prints the header of the models status table.
+
+    """
+    logging.info('+{0}+'.format('-'.center(52, '-')))
+    logging.info('|{0}|{1}|{2}|'.format('MODEL'.center(20), 'OpenDAP'.center(15), 'CDAT'.center(15)))
+    logging.info('+{0}+'.format('='.center(52, '=')))
+
+
+def collect(ctx, result):
+    """
+    Prints the status of a model and writes its results into the output files.
+
+    :param ProcessingContext ctx: The processing context
+    :param ModelResult result: The model results
+
+    """
+    logging.info('| {0}| {1}| {2}|'.format(result.model.ljust(19),
+                                           result.urls_status.ljust(14),
+                                           result.xmls_status.ljust(14)))
+    with ctx.metrics.phase('outputs'):
+        if ctx.matrix:
+            ctx.matrix.add_result(result)
+        if ctx.agg_writer:
+            ctx.agg_writer.writelines(result.aggregations)
+        if ctx.miss_writer:
+            ctx.miss_writer.writelines(result.missing)
 
 
 def main():
@@ -547,33 +2321,91 @@ def main():
      * Prints or logs the search results.
 
     """
+    # Daemon mode
+    if sys.argv[1:2] == ['serve']:
+        from .server import serve
+        return serve(sys.argv[2:])
+    # Shards merge
+    if sys.argv[1:2] == ['merge']:
+        from .merge import merge
+        return merge(sys.argv[2:])
     # Initialise processing context
     args = get_args()
-    ctx = ProcessingContext(args, get_requirements(args.inputfile))
-    logging.info('==> Searching for aggregations...')
-    logging.info('+{0}+'.format('-'.center(52, '-')))
-    logging.info('|{0}|{1}|{2}|'.format('MODEL'.center(20), 'OpenDAP'.center(15), 'CDAT'.center(15)))
-    logging.info('+{0}+'.format('='.center(52, '=')))
-    for ctx.institute in ctx.institutes:
-        for ctx.model in ctx.institute.models:
-            xmls_status = all_xmls_exist(ctx)
-            urls_status = all_urls_exist(ctx)
-            logging.info('| {0}| {1}| {2}|'.format(ctx.model.ljust(19), urls_status.ljust(14), xmls_status.ljust(14)))
-            if urls_status is COMPLETE:
-                write_urls(ctx)
-            else:
-                get_missing_urls(ctx)
-            if xmls_status is COMPLETE:
-                write_xmls(ctx)
-            else:
-                get_missing_xmls(ctx)
-            if urls_status is not COMPLETE or xmls_status is not COMPLETE:
-                get_missing_data(ctx)
-    # Close thread pool
-    ctx.pool.close()
-    ctx.pool.join()
-    logging.info('+{0}+'.format('-'.center(52, '-')))
+    if not args.inputfile:
+        raise Exception('No JSON template')
+    if args.status_only and (args.agg or args.miss or args.matrix or args.coverage or args.complete):
+        raise Exception('No output file can be written with --status-only')
+    if args.status_only and (args.incremental or args.journal or args.resume or args.shard or args.results):
+        raise Exception('The partial results of --status-only cannot be saved nor reused')
+    templates = [os.path.splitext(os.path.basename(f.name))[0] for f in args.inputfile]
+    requirements = [get_requirements(f) for f in args.inputfile]
+    if len(templates) == 1:
+        ctx = ProcessingContext(args, requirements[0])
+    else:
+        # The batch context has no output, it shares the workers, connections, tests results and listings
+        if len(set(templates)) < len(templates):
+            raise Exception('Templates of a batch must have different names')
+        ctx = ProcessingContext(argparse.Namespace(**dict(vars(args), agg=None, miss=None, incremental=None,
+                                                          matrix=None, coverage=None, complete=None, journal=None,
+                                                          resume=False)),
+                                get_batch_requirements(requirements))
+    try:
+        if len(templates) == 1:
+            contexts = [ctx]
+        else:
+            contexts = [get_template_context(ctx, args, template, request)
+                        for template, request in zip(templates, requirements)]
+        for request, request_requirements in zip(contexts, requirements):
+            logging.info('==> Searching for aggregations{0}...'.format(
+                ' of {0}'.format(request.template) if request.template else ''))
+            log_header()
+            # Process models concurrently, results are collected in the institutes/models order
+            # and the pipeline is stopped if their collect fails
+            with closing(search(request, args.jobs)) as results:
+                for result in results:
+                    collect(request, result)
+                    if request.results is not None:
+                        request.results.append(result)
+                    if request.snapshot:
+                        request.snapshot.set_result(result.institute, result.model, result.dump())
+            # Write output files
+            with request.metrics.phase('outputs'):
+                for writer in [request.agg_writer, request.miss_writer]:
+                    if writer:
+                        writer.close()
+                if request.matrix_file:
+                    request.matrix.save(request.matrix_file)
+                if request.coverage_file:
+                    request.matrix.write_summaries(request.coverage_file)
+                if request.complete_file:
+                    request.matrix.write_coverage(request.complete_file, request.max_missing)
+                if request.results_file:
+                    write_results(request, request_requirements)
+            if request.snapshot:
+                request.snapshot.save()
+            logging.info('+{0}+'.format('-'.center(52, '-')))
+        # The journals are only needed to resume an incomplete run
+        for request in contexts:
+            if request.journal:
+                request.journal.remove()
+        # Wait for the last tasks of the thread pool
+        ctx.pool.close()
+    except BaseException:
+        # Drop the outstanding tasks of the failed search
+        ctx.pool.terminate()
+        raise
+    finally:
+        # Close thread pool and HTTP connections
+        ctx.pool.join()
+        ctx.prober.close()
+        if ctx.cache:
+            ctx.cache.close()
     logging.info('==> Search complete.')
+    # Write run metrics
+    if args.metrics:
+        ctx.metrics.write_json(args.metrics)
+    if args.prometheus:
+        ctx.metrics.write_prometheus(args.prometheus)
 
 
 # Main entry point for stand-alone call.
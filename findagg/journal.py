@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Append-only journal of the completed models to resume an interrupted run.
+
+"""
+
+# Module imports
+import hashlib
+import json
+import os
+from threading import Lock
+
+
+class Journal(object):
+    """
+    Records the results of each model as soon as it is completed, one JSON line per model
+    synced on disk, after a first line identifying the request.
+    When resuming, the models of the journal of an interrupted run with the same request are not
+    processed again and their results are collected as recorded. A line truncated by the interruption
+    is dropped.
+
+    :param str path: The journal file
+    :param object request: Any JSON serializable object identifying the request (requirements, outputs)
+    :param boolean resume: True to reuse the journal of an interrupted run
+    :returns: The journal
+    :rtype: *Journal*
+    :raises Error: If the journal to resume was written for another request
+
+    """
+
+    def __init__(self, path, request, resume=False):
+        self.path = path
+        self.key = hashlib.md5(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+        self.models = dict()
+        self.lock = Lock()
+        if resume and os.path.isfile(path):
+            size = self.read()
+            self.file = open(path, 'r+')
+            # Drop the end of a truncated journal
+            self.file.truncate(size)
+            self.file.seek(size)
+        else:
+            directory = os.path.dirname(os.path.abspath(path))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.file = open(path, 'w')
+            self.append({'key': self.key})
+
+    def read(self):
+        """
+        Reads the results recorded in the journal.
+
+        :returns: The size of the valid part of the journal
+        :rtype: *int*
+        :raises Error: If the journal was written for another request
+
+        """
+        size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                if size == 0:
+                    if record.get('key') != self.key:
+                        raise Exception('{0} is the journal of another request'.format(self.path))
+                else:
+                    self.models['/'.join([record['institute'], record['model']])] = record
+                size += len(line)
+        if size == 0:
+            raise Exception('{0} is not a valid journal'.format(self.path))
+        return size
+
+    def append(self, record):
+        """
+        Appends a record and syncs it on disk.
+
+        :param dict record: The JSON serializable record
+
+        """
+        with self.lock:
+            self.file.write(json.dumps(record, sort_keys=True) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def is_completed(self, institute, model):
+        """
+        Returns True if a model was completed by the interrupted run.
+
+        :param str institute: The institute
+        :param str model: The model
+        :returns: True if the model results are in the journal
+        :rtype: *boolean*
+
+        """
+        return '/'.join([institute, model]) in self.models
+
+    def get_result(self, institute, model):
+        """
+        Returns the recorded results of a model.
+
+        :param str institute: The institute
+        :param str model: The model
+        :returns: The model results as recorded by :meth:`set_result`
+        :rtype: *dict*
+
+        """
+        return self.models['/'.join([institute, model])]
+
+    def set_result(self, institute, model, result):
+        """
+        Records the results of a completed model.
+
+        :param str institute: The institute
+        :param str model: The model
+        :param dict result: The JSON serializable model results
+
+        """
+        if not self.is_completed(institute, model):
+            self.append(result)
+
+    def remove(self):
+        """
+        Closes and removes the journal once the run is complete.
+
+        """
+        self.file.close()
+        os.remove(self.path)
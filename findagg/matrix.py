@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Dense status matrix of the tests results with columnar export and per-facet summaries.
+
+"""
+
+# Module imports
+import binascii
+import io
+import json
+from itertools import combinations
+
+from .output import atomic_path, write_atomically
+
+# Tested endpoints: THREDDS OpenDAP urls and CDAT xml files
+ENDPOINTS = ['opendap', 'cdat']
+
+# Tests outcomes, their codes in the exported array being their position plus one (0 when not tested)
+STATES = ['present', 'missing', 'unknown']
+
+# Summarized facets
+FACETS = ['model', 'experiment', 'ensemble', 'variable']
+
+
+class StatusMatrix(object):
+    """
+    Tests outcomes indexed by (model, experiment, ensemble, variable, endpoint), built while models are processed.
+    The models are labelled by (institute, model) since a model name can be used by several institutes.
+    The (model, ensemble) couples are the rows of the matrix. For each experiment, variable, endpoint and outcome,
+    a bitset (a Python integer) flags the rows with that outcome, so that summaries and queries are bitwise
+    operations and bits counts instead of loops upon aggregations.
+
+    :param list experiments: The experiments from the requirements (optional)
+    :param list variables: The variables from the requirements (optional)
+    :returns: The status matrix
+    :rtype: *StatusMatrix*
+
+    """
+
+    def __init__(self, experiments=None, variables=None):
+        self.labels = dict((facet, list()) for facet in FACETS)
+        self.indexes = dict((facet, dict()) for facet in FACETS)
+        self.rows = list()
+        self.row_indexes = dict()
+        self.bits = dict(((endpoint, state), dict()) for endpoint in ENDPOINTS for state in STATES)
+        for experiment in experiments or []:
+            self.get_index('experiment', experiment)
+        for variable in sorted(variables or []):
+            self.get_index('variable', variable)
+
+    def get_index(self, facet, label):
+        """
+        Returns the index of a facet label, adding it to the facet axis if new.
+
+        :param str facet: The facet name
+        :param str label: The facet label
+        :returns: The label index
+        :rtype: *int*
+
+        """
+        if label not in self.indexes[facet]:
+            self.indexes[facet][label] = len(self.labels[facet])
+            self.labels[facet].append(label)
+        return self.indexes[facet][label]
+
+    def get_row(self, institute, model, ensemble):
+        """
+        Returns the row of a (model, ensemble) couple, adding it if new.
+
+        :param str institute: The institute
+        :param str model: The model
+        :param str ensemble: The ensemble
+        :returns: The row index
+        :rtype: *int*
+
+        """
+        couple = (self.get_index('model', (institute, model)), self.get_index('ensemble', ensemble))
+        if couple not in self.row_indexes:
+            self.row_indexes[couple] = len(self.rows)
+            self.rows.append(couple)
+        return self.row_indexes[couple]
+
+    def add(self, institute, model, endpoint, experiment, ensemble, variable, result):
+        """
+        Records a test outcome.
+
+        :param str institute: The institute
+        :param str model: The model
+        :param str endpoint: The tested endpoint, i.e. ``opendap`` or ``cdat``
+        :param str experiment: The experiment
+        :param str ensemble: The ensemble
+        :param str variable: The variable
+        :param boolean result: The test result, None if unknown
+
+        """
+        row = self.get_row(institute, model, ensemble)
+        cell = (self.get_index('experiment', experiment), self.get_index('variable', variable))
+        state = STATES[2] if result is None else STATES[0] if result else STATES[1]
+        bits = self.bits[(endpoint, state)]
+        bits[cell] = bits.get(cell, 0) | 1 << row
+
+    def add_result(self, result):
+        """
+        Records the tests outcomes of a model.
+
+        :param ModelResult result: The model results
+
+        """
+        for probe in result.probes:
+            self.add(result.institute, result.model, *probe)
+
+    def get(self, endpoint, state, experiment, variable):
+        """
+        Returns the rows with an outcome for an experiment and a variable.
+
+        :param str endpoint: The endpoint
+        :param str state: The outcome, i.e. ``present``, ``missing`` or ``unknown``
+        :param int experiment: The experiment index
+        :param int variable: The variable index
+        :returns: The rows bitset
+        :rtype: *int*
+
+        """
+        return self.bits[(endpoint, state)].get((experiment, variable), 0)
+
+    def get_tested(self, endpoint, experiment, variable):
+        """
+        Like :meth:`get`, but returns the rows tested whatever the outcome.
+
+        """
+        return reduce_or(self.get(endpoint, state, experiment, variable) for state in STATES)
+
+    def get_masks(self, facet):
+        """
+        Returns the rows of each label of a facet.
+
+        :param str facet: The facet name
+        :returns: The rows bitset of each label
+        :rtype: *list*
+
+        """
+        masks = [0] * len(self.labels[facet])
+        if facet in ('model', 'ensemble'):
+            position = 0 if facet == 'model' else 1
+            for row, couple in enumerate(self.rows):
+                masks[couple[position]] |= 1 << row
+        return masks
+
+    def summary(self, facet):
+        """
+        Returns the completeness of each label of a facet: numbers of tested and present aggregations
+        and the present fraction, for each endpoint. Models are labelled as ``institute/model``.
+
+        :param str facet: The facet name, i.e. ``model``, ``experiment``, ``ensemble`` or ``variable``
+        :returns: The summary by label and endpoint
+        :rtype: *dict*
+
+        """
+        masks = self.get_masks(facet)
+        summary = dict()
+        for index, label in enumerate(self.labels[facet]):
+            if facet == 'model':
+                label = '/'.join(label)
+            summary[label] = dict()
+            for endpoint in ENDPOINTS:
+                tested = present = 0
+                for experiment, variable in self.get_cells(facet, index):
+                    rows = self.get_tested(endpoint, experiment, variable)
+                    found = self.get(endpoint, STATES[0], experiment, variable)
+                    if facet in ('model', 'ensemble'):
+                        rows, found = rows & masks[index], found & masks[index]
+                    tested += count(rows)
+                    present += count(found)
+                summary[label][endpoint] = {'tested': tested,
+                                            'present': present,
+                                            'fraction': round(float(present) / tested, 4) if tested else None}
+        return summary
+
+    def get_cells(self, facet, index):
+        """
+        Returns the (experiment, variable) indexes to sum for a label of a facet.
+
+        """
+        experiments = range(len(self.labels['experiment']))
+        variables = range(len(self.labels['variable']))
+        if facet == 'experiment':
+            experiments = [index]
+        elif facet == 'variable':
+            variables = [index]
+        return [(experiment, variable) for experiment in experiments for variable in variables]
+
+    def summaries(self):
+        """
+        Returns the summary of every facet.
+
+        :returns: The summaries by facet
+        :rtype: *dict*
+
+        """
+        return dict((facet, self.summary(facet)) for facet in FACETS)
+
+    def to_array(self):
+        """
+        Returns the matrix as a dense NumPy array of shape (model, experiment, ensemble, variable, endpoint).
+        Codes are 0 if not tested, then 1, 2 and 3 for present, missing and unknown, see :data:`STATES`.
+
+        :returns: The status array
+        :rtype: *numpy.ndarray*
+        :raises Error: If NumPy is not installed
+
+        """
+        numpy = import_numpy()
+        shape = tuple(len(self.labels[facet]) for facet in FACETS)
+        array = numpy.zeros(shape + (len(ENDPOINTS),), dtype=numpy.uint8)
+        if not self.rows:
+            return array
+        rows = numpy.array(self.rows, dtype=numpy.intp)
+        for (endpoint, state), bits in self.bits.items():
+            for (experiment, variable), rows_bits in bits.items():
+                selected = rows[to_bool_array(rows_bits, len(self.rows))]
+                array[selected[:, 0], experiment, selected[:, 1], variable, ENDPOINTS.index(endpoint)] = \
+                    STATES.index(state) + 1
+        return array
+
+    def save(self, path):
+        """
+        Exports the matrix to a NumPy ``.npz`` file (the status array and the axes labels)
+        or to a Parquet file (one row per test) depending on the file extension.
+
+        :param str path: The output file
+        :raises Error: If the format is not supported or its library is not installed
+
+        """
+        check_format(path)
+        if path.endswith('.npz'):
+            numpy = import_numpy()
+            content = io.BytesIO()
+            labels = dict(('{0}s'.format(facet), numpy.array(self.labels[facet])) for facet in FACETS[1:])
+            numpy.savez_compressed(content,
+                                   status=self.to_array(),
+                                   institutes=numpy.array([institute for institute, _ in self.labels['model']]),
+                                   models=numpy.array([model for _, model in self.labels['model']]),
+                                   endpoints=numpy.array(ENDPOINTS),
+                                   states=numpy.array(STATES),
+                                   **labels)
+            write_atomically(path, content.getvalue())
+        else:
+            import pyarrow
+            import pyarrow.parquet
+            columns = dict((name, list()) for name in ['institute', 'model', 'experiment', 'ensemble',
+                                                       'variable', 'endpoint', 'status'])
+            for test in self.get_tests():
+                for name, value in zip(['institute', 'model', 'experiment', 'ensemble',
+                                        'variable', 'endpoint', 'status'], test):
+                    columns[name].append(value)
+            with atomic_path(path) as tmp:
+                pyarrow.parquet.write_table(pyarrow.table(columns), tmp)
+
+    def get_tests(self):
+        """
+        Yields the tests outcomes as (institute, model, experiment, ensemble, variable, endpoint, status) tuples.
+
+        :returns: An iterator on tests outcomes
+        :rtype: *iter*
+
+        """
+        for (endpoint, state), bits in sorted(self.bits.items()):
+            for (experiment, variable), rows_bits in sorted(bits.items()):
+                for row in iter_bits(rows_bits):
+                    model, ensemble = self.rows[row]
+                    institute, model = self.labels['model'][model]
+                    yield (institute, model, self.labels['experiment'][experiment],
+                           self.labels['ensemble'][ensemble], self.labels['variable'][variable], endpoint, state)
+
+    def get_complete(self, endpoint, variables):
+        """
+        Returns the rows with an available aggregation for every experiment and some variables.
+
+        :param str endpoint: The endpoint
+        :param list variables: The variables indexes
+        :returns: The rows bitset
+        :rtype: *int*
+
+        """
+        rows = (1 << len(self.rows)) - 1
+        for experiment in range(len(self.labels['experiment'])):
+            for variable in variables:
+                rows &= self.get(endpoint, STATES[0], experiment, variable)
+        return rows
+
+    def get_couples(self, rows):
+        """
+        Returns the (institute, model, ensemble) couples of rows.
+
+        :param int rows: The rows bitset
+        :returns: The sorted couples
+        :rtype: *list*
+
+        """
+        couples = list()
+        for row in iter_bits(rows):
+            model, ensemble = self.rows[row]
+            institute, model = self.labels['model'][model]
+            couples.append([institute, model, self.labels['ensemble'][ensemble]])
+        return sorted(couples)
+
+    def coverage(self, max_missing=1):
+        """
+        Returns, for each endpoint, the (model, ensemble) couples with every requested aggregation available,
+        then the best partial sets: the couples gained by giving up up to ``max_missing`` variables,
+        ranked by decreasing number of couples.
+        Each set is the intersection of the bitsets of the kept variables upon all experiments.
+
+        :param int max_missing: The maximum number of variables to give up
+        :returns: The complete and partial sets by endpoint
+        :rtype: *dict*
+
+        """
+        variables = range(len(self.labels['variable']))
+        coverage = dict()
+        for endpoint in ENDPOINTS:
+            complete = self.get_complete(endpoint, variables)
+            by_variable = [self.get_complete(endpoint, [variable]) for variable in variables]
+            partial = list()
+            for missing in range(1, min(max_missing, len(variables) - 1) + 1):
+                for dropped in combinations(variables, missing):
+                    rows = (1 << len(self.rows)) - 1
+                    for variable in variables:
+                        if variable not in dropped:
+                            rows &= by_variable[variable]
+                    if rows != complete:
+                        partial.append((count(rows), [self.labels['variable'][v] for v in dropped], rows))
+            partial.sort(key=lambda item: (-item[0], len(item[1]), item[1]))
+            coverage[endpoint] = {'complete': self.get_couples(complete),
+                                  'partial': [{'missing': dropped, 'count': number, 'couples': self.get_couples(rows)}
+                                              for number, dropped, rows in partial]}
+        return coverage
+
+    def write_coverage(self, path, max_missing=1):
+        """
+        Writes the complete and best partial sets as JSON, see :meth:`coverage`.
+
+        :param str path: The output file
+        :param int max_missing: The maximum number of variables to give up
+
+        """
+        write_atomically(path, json.dumps(self.coverage(max_missing), indent=2, sort_keys=True) + '\n')
+
+    def write_summaries(self, path):
+        """
+        Writes the summaries of every facet as JSON.
+
+        :param str path: The output file
+
+        """
+        write_atomically(path, json.dumps(self.summaries(), indent=2, sort_keys=True) + '\n')
+
+
+def check_format(path):
+    """
+    Checks that the status matrix can be exported into a file before the run.
+
+    :param str path: The output file
+    :raises Error: If the format is not supported or its library is not installed
+
+    """
+    if path.endswith('.npz'):
+        import_numpy()
+    elif path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception('pyarrow is required to export the status matrix to Parquet')
+    else:
+        raise Exception('{0}: unsupported status matrix format (.npz or .parquet)'.format(path))
+
+
+def import_numpy():
+    """
+    Returns the NumPy module, only imported to export the status matrix.
+
+    :returns: The NumPy module
+    :rtype: *module*
+    :raises Error: If NumPy is not installed
+
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise Exception('NumPy is required to export the status matrix')
+    return numpy
+
+
+def count(bits):
+    """
+    Returns the number of bits set in a bitset.
+
+    :param int bits: The bitset
+    :returns: The number of bits set
+    :rtype: *int*
+
+    """
+    return bin(bits).count('1')
+
+
+def reduce_or(bitsets):
+    """
+    Returns the union of bitsets.
+
+    :param iter bitsets: The bitsets
+    :returns: The union bitset
+    :rtype: *int*
+
+    """
+    union = 0
+    for bits in bitsets:
+        union |= bits
+    return union
+
+
+def iter_bits(bits):
+    """
+    Yields the positions of the bits set in a bitset, in increasing order.
+
+    :param int bits: The bitset
+    :returns: An iterator on positions
+    :rtype: *iter*
+
+    """
+    for position, bit in enumerate(reversed(bin(bits)[2:])):
+        if bit == '1':
+            yield position
+
+
+def to_bool_array(bits, size):
+    """
+    Returns a bitset as a NumPy boolean array, converting it at once through its bytes.
+
+    :param int bits: The bitset
+    :param int size: The number of positions
+    :returns: The boolean array
+    :rtype: *numpy.ndarray*
+
+    """
+    numpy = import_numpy()
+    nbytes = (size + 7) // 8
+    data = binascii.unhexlify('{0:x}'.format(bits).zfill(2 * nbytes))
+    return numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8))[::-1][:size].astype(bool)
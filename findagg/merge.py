@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Merges the results of shards into the outputs of a single run.
+
+"""
+
+# Module imports
+import argparse
+import json
+import logging
+import os
+
+from .findagg import MultilineFormatter, ModelResult, SortedWriter
+from .findagg import collect, get_matrix, init_logging, log_header
+from .metrics import Metrics
+
+
+def read_shards(paths):
+    """
+    Reads the results files of shards and checks that they are the complete shards of the same request,
+    i.e. with the same requirements, roots, options and shards count.
+
+    :param list paths: The results files written with ``--shard``
+    :returns: The request shared by the shards and the models results in the institutes/models order
+    :rtype: *tuple*
+    :raises Error: If the shards are not from the same request or some are missing
+
+    """
+    request, count, shards, results = None, None, set(), list()
+    for path in paths:
+        with open(path) as f:
+            header = json.loads(f.readline())
+            index, shard_count = header.pop('shard')
+            if request is None:
+                request, count = header, shard_count
+            elif header != request or shard_count != count:
+                raise Exception('{0} is not a shard of the same request'.format(path))
+            if index in shards:
+                raise Exception('{0}: shard {1}/{2} is given twice'.format(path, index, count))
+            shards.add(index)
+            results.extend(ModelResult.load(json.loads(line)) for line in f if line.strip())
+    missing = sorted(set(range(1, count + 1)) - shards)
+    if missing:
+        raise Exception('Missing shards: {0}'.format(', '.join('{0}/{1}'.format(i, count) for i in missing)))
+    return request, sorted(results, key=lambda result: (result.institute, result.model))
+
+
+def get_args(argv):
+    """
+    Returns parsed command-line arguments of the merge. See ``find_agg merge -h`` for full description.
+
+    :param list argv: The command-line arguments following ``merge``
+    :returns: The corresponding ``argparse`` Namespace
+    :rtype: *ArgumentParser*
+
+    """
+    parser = argparse.ArgumentParser(
+        prog='find_agg merge',
+        description="""
+        Merges the results of "find_agg --shard i/N" runs into the status table and|n
+        the output files a single run would produce.
+        """,
+        formatter_class=MultilineFormatter,
+        add_help=False)
+    parser.add_argument(
+        'shards',
+        nargs='+',
+        type=str,
+        help="""Results files of every shard.""")
+    parser.add_argument(
+        '--agg',
+        nargs='?',
+        metavar='$PWD/aggregations.list',
+        type=str,
+        const='{0}/aggregations.list'.format(os.getcwd()),
+        help="""Output file with available aggregations list.""")
+    parser.add_argument(
+        '--miss',
+        nargs='?',
+        metavar='$PWD/missing_data.list',
+        type=str,
+        const='{0}/missing_data.list'.format(os.getcwd()),
+        help="""Output file with the list of missing data.""")
+    parser.add_argument(
+        '--matrix',
+        metavar='PATH',
+        type=str,
+        help="""Output file with the status matrix (.npz or .parquet).""")
+    parser.add_argument(
+        '--coverage',
+        metavar='PATH',
+        type=str,
+        help="""Output file with the facets summaries (JSON).""")
+    parser.add_argument(
+        '--complete',
+        metavar='PATH',
+        type=str,
+        help="""Output file with the complete and partial sets (JSON).""")
+    parser.add_argument(
+        '--max-missing',
+        metavar='1',
+        type=int,
+        default=1,
+        help="""Maximum number of variables to give up in partial sets.""")
+    parser.add_argument(
+        '--log',
+        metavar='$PWD',
+        type=str,
+        const=os.getcwd(),
+        nargs='?',
+        help="""Logfile directory.""")
+    parser.add_argument(
+        '-h', '--help',
+        action='help',
+        help="""Show this help message and exit.""")
+    return parser.parse_args(argv)
+
+
+def merge(argv):
+    """
+    Merge process that\:
+     * Reads and checks the shards results,
+     * Prints or logs the models status in the institutes/models order,
+     * Writes the output files.
+
+    :param list argv: The command-line arguments following ``merge``
+    :raises Error: If the status matrix is requested from shards processed without it
+
+    """
+    args = get_args(argv)
+    init_logging(args.log)
+    request, results = read_shards(args.shards)
+    # Only the outputs of the processing context are needed to collect results
+    ctx = argparse.Namespace(metrics=Metrics(),
+                             matrix=get_matrix(args, request['requirements']),
+                             agg_writer=SortedWriter(args.agg) if args.agg else None,
+                             miss_writer=SortedWriter(args.miss) if args.miss else None)
+    if ctx.matrix and not request['probes']:
+        raise Exception('Shards were processed without --matrix, --coverage or --complete')
+    logging.info('==> Merging {0} shards...'.format(len(args.shards)))
+    log_header()
+    for result in results:
+        collect(ctx, result)
+    for writer in [ctx.agg_writer, ctx.miss_writer]:
+        if writer:
+            writer.close()
+    if args.matrix:
+        ctx.matrix.save(args.matrix)
+    if args.coverage:
+        ctx.matrix.write_summaries(args.coverage)
+    if args.complete:
+        ctx.matrix.write_coverage(args.complete, args.max_missing)
+    logging.info('+{0}+'.format('-'.center(52, '-')))
+    logging.info('==> Merge complete.')
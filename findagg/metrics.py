@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Run metrics: phases timings, requests and filesystem calls counts, latencies percentiles.
+
+"""
+
+# Module imports
+import json
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from .output import write_atomically
+
+# Reported latency percentiles
+PERCENTILES = [50, 90, 99]
+
+# Prometheus metrics prefix
+PROMETHEUS_PREFIX = 'findagg'
+
+
+class Metrics(object):
+    """
+    Thread-safe collector of the run metrics.
+
+    +---------------------+----------+--------------------------------------------------+
+    | Metric              | Type     | Description                                      |
+    +=====================+==========+==================================================+
+    | *self*.phases       | *dict*   | Cumulative wall time in seconds per phase        |
+    +---------------------+----------+--------------------------------------------------+
+    | *self*.models       | *dict*   | Wall time in seconds per phase for each model,   |
+    |                     |          | keyed by institute and model                     |
+    +---------------------+----------+--------------------------------------------------+
+    | *self*.counters     | *dict*   | Number of HTTP requests, stat/listdir calls, etc |
+    +---------------------+----------+--------------------------------------------------+
+    | *self*.latencies    | *dict*   | Latency samples in seconds                       |
+    +---------------------+----------+--------------------------------------------------+
+
+    :returns: The metrics collector
+    :rtype: *Metrics*
+
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = dict()
+        self.models = dict()
+        self.counters = dict()
+        self.latencies = dict()
+        self.lock = Lock()
+
+    @contextmanager
+    def phase(self, name, institute=None, model=None):
+        """
+        Records the wall time of a ``with`` block into a phase, and into the model phases if any.
+
+        :param str name: The phase name
+        :param str institute: The institute of the model in process
+        :param str model: The model in process
+
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+                if model:
+                    phases = self.models.setdefault((institute, model), dict())
+                    phases[name] = phases.get(name, 0.0) + elapsed
+
+    def count(self, name, value=1):
+        """
+        Increments a counter.
+
+        :param str name: The counter name
+        :param int value: The increment
+
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """
+        Records a latency sample.
+
+        :param str name: The latency name
+        :param float seconds: The observed latency
+
+        """
+        with self.lock:
+            self.latencies.setdefault(name, list()).append(seconds)
+
+    def summary(self):
+        """
+        Returns the metrics summary.
+
+        :returns: The JSON serializable summary
+        :rtype: *dict*
+
+        """
+        with self.lock:
+            latencies = dict()
+            for name, samples in self.latencies.items():
+                samples = sorted(samples)
+                latencies[name] = dict(('p{0}'.format(p), round(percentile(samples, p), 6)) for p in PERCENTILES)
+                latencies[name]['max'] = round(samples[-1], 6)
+                latencies[name]['sum'] = round(sum(samples), 6)
+                latencies[name]['count'] = len(samples)
+            return {'seconds': round(time.time() - self.start, 4),
+                    'phases': dict((k, round(v, 4)) for k, v in self.phases.items()),
+                    'models': dict(('/'.join(m), dict((k, round(v, 4)) for k, v in p.items()))
+                                   for m, p in self.models.items()),
+                    'counters': dict(self.counters),
+                    'latencies': latencies}
+
+    def write_json(self, path):
+        """
+        Writes the metrics summary as JSON.
+
+        :param str path: The output file
+
+        """
+        write_atomically(path, json.dumps(self.summary(), indent=2, sort_keys=True) + '\n')
+
+    def write_prometheus(self, path):
+        """
+        Writes the metrics summary in the Prometheus text format, for the node exporter textfile collector.
+
+        :param str path: The output file (``.prom`` extension)
+
+        """
+        summary = self.summary()
+        lines = list()
+
+        def add(name, kind, description, samples):
+            name = '{0}_{1}'.format(PROMETHEUS_PREFIX, name)
+            lines.append('# HELP {0} {1}'.format(name, description))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for labels, value in samples:
+                labels = ','.join('{0}="{1}"'.format(k, v) for k, v in labels)
+                lines.append('{0}{1} {2}'.format(name, '{{{0}}}'.format(labels) if labels else '', value))
+
+        add('run_seconds', 'gauge', 'Wall time of the run.', [([], summary['seconds'])])
+        add('phase_seconds', 'gauge', 'Cumulative wall time per phase.',
+            [([('phase', k)], v) for k, v in sorted(summary['phases'].items())])
+        add('model_phase_seconds', 'gauge', 'Wall time per phase and model.',
+            [(list(zip(['institute', 'model'], m.split('/'))) + [('phase', k)], v)
+             for m, p in sorted(summary['models'].items()) for k, v in sorted(p.items())])
+        for name, value in sorted(summary['counters'].items()):
+            add(name, 'gauge', 'Number of {0} during the run.'.format(name.replace('_', ' ')), [([], value)])
+        for name, stats in sorted(summary['latencies'].items()):
+            samples = [([('quantile', p / 100.0)], stats['p{0}'.format(p)]) for p in PERCENTILES]
+            add('{0}_seconds'.format(name), 'summary', 'Latency of {0}.'.format(name.replace('_', ' ')), samples)
+            lines.append('{0}_{1}_seconds_sum {2}'.format(PROMETHEUS_PREFIX, name, stats['sum']))
+            lines.append('{0}_{1}_seconds_count {2}'.format(PROMETHEUS_PREFIX, name, stats['count']))
+        write_atomically(path, '\n'.join(lines) + '\n')
+
+
+def percentile(samples, p):
+    """
+    Returns the nearest-rank percentile of sorted samples.
+
+    :param list samples: The sorted samples
+    :param int p: The percentile
+    :returns: The percentile value
+    :rtype: *float*
+
+    """
+    return samples[max(0, min(len(samples) - 1, int(round(p / 100.0 * len(samples))) - 1))]
+
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Buffered output files with sorted and unique lines, atomically replaced.
+
+"""
+
+# Module imports
+import gzip
+import heapq
+import os
+import tempfile
+from contextlib import contextmanager
+
+# Number of lines kept in memory before spilling a sorted run on disk
+BUFFER_SIZE = 100000
+
+# Mode of the output files, as if created directly (the umask is read once, reading it means setting it)
+UMASK = os.umask(0)
+os.umask(UMASK)
+FILE_MODE = 0o666 & ~UMASK
+
+
+class SortedWriter(object):
+    """
+    Writes sorted and unique lines into an output file.
+    Lines are buffered in memory and spilled into sorted temporary runs when the buffer is full.
+    On close, the runs are merged in a streaming fashion into a temporary file next to the output,
+    which then atomically replaces the output. An interrupted run never leaves a half-written file.
+
+    :param str path: The output file
+    :param boolean compress: True to gzip the output (default if the path ends with ``.gz``)
+    :param int buffer_size: The number of lines to keep in memory
+    :returns: The output writer
+    :rtype: *SortedWriter*
+
+    """
+
+    def __init__(self, path, compress=None, buffer_size=BUFFER_SIZE):
+        self.path = os.path.abspath(path)
+        self.compress = path.endswith('.gz') if compress is None else compress
+        self.buffer_size = buffer_size
+        self.buffer = set()
+        self.runs = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, line):
+        """
+        Adds a line to the output.
+
+        :param str line: The line without end-of-line character
+
+        """
+        self.buffer.add(u'{0}\n'.format(line).encode('utf-8'))
+        if len(self.buffer) >= self.buffer_size:
+            self.spill()
+
+    def writelines(self, lines):
+        """
+        Adds lines to the output.
+
+        :param iter lines: The lines without end-of-line character
+
+        """
+        for line in lines:
+            self.write(line)
+
+    def spill(self):
+        """
+        Writes the buffered lines into a sorted temporary run.
+
+        """
+        run = tempfile.TemporaryFile()
+        run.writelines(sorted(self.buffer))
+        run.seek(0)
+        self.runs.append(run)
+        self.buffer = set()
+
+    def close(self):
+        """
+        Merges the runs into the output file, skipping duplicates, and atomically replaces it.
+
+        """
+        try:
+            with atomic_path(self.path) as tmp, open(tmp, 'wb') as f:
+                output = gzip.GzipFile(filename=os.path.basename(self.path), mode='wb', fileobj=f) \
+                    if self.compress else f
+                previous = None
+                for line in heapq.merge(sorted(self.buffer), *self.runs):
+                    if line != previous:
+                        output.write(line)
+                        previous = line
+                if self.compress:
+                    output.close()
+        finally:
+            self.discard()
+
+    def discard(self):
+        """
+        Drops the buffered lines and the temporary runs without touching the output file.
+
+        """
+        for run in self.runs:
+            run.close()
+        self.runs = list()
+        self.buffer = set()
+
+
+def write_atomically(path, content):
+    """
+    Writes a file through a temporary file renamed upon the target, so that readers never see a partial file.
+
+    :param str path: The output file
+    :param str content: The file content, text or bytes
+
+    """
+    with atomic_path(path) as tmp, open(tmp, 'wb' if isinstance(content, bytes) else 'w') as f:
+        f.write(content)
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Yields a temporary file next to an output file, which atomically replaces the output once the ``with`` block
+    completes and is removed if the block fails.
+
+    :param str path: The output file
+    :returns: A context manager giving the temporary file path
+    :rtype: *contextmanager*
+
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.{0}.'.format(name))
+    os.close(fd)
+    try:
+        yield tmp
+        os.chmod(tmp, FILE_MODE)
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Stages running concurrently, connected by bounded queues.
+
+"""
+
+# Module imports
+from threading import Event, Thread
+
+try:
+    from Queue import Empty, Full, Queue
+except ImportError:
+    from queue import Empty, Full, Queue
+
+# Number of items waiting between two stages
+QUEUE_SIZE = 4
+
+# Time in seconds between two checks of the pipeline interruption
+POLL_INTERVAL = 0.1
+
+# End of the items of a stage worker
+DONE = object()
+
+
+class Failure(object):
+    """
+    Carries the error raised by a stage down to the output of the pipeline.
+
+    :param Exception error: The error
+    :returns: The stage failure
+    :rtype: *Failure*
+
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+class Pipeline(object):
+    """
+    Runs items through successive stages, each stage processing its items in its own threads.
+    Stages are connected by bounded queues: a stage waits when the next one is late, so that
+    only a few items are in process at once and the wall time approaches the one of the slowest stage.
+    Items are given back in their input order.
+
+    :param list stages: The functions applied to each item in turn, each one taking the result of the previous one
+    :param int workers: The number of threads of each stage
+    :param int size: The number of items waiting between two stages
+    :returns: The pipeline
+    :rtype: *Pipeline*
+
+    """
+
+    def __init__(self, stages, workers=1, size=QUEUE_SIZE):
+        self.stages = stages
+        self.workers = workers
+        self.size = size
+        self.stopped = Event()
+
+    def imap(self, items):
+        """
+        Yields the results of the last stage upon items, in the items order.
+        The items are read in a thread of their own, as a first stage.
+
+        :param iter items: The items to process
+        :returns: An iterator on the results
+        :rtype: *iter*
+        :raises Error: The first error raised by a stage
+
+        """
+        queues = [Queue(self.size) for _ in range(len(self.stages) + 1)]
+        threads = [Thread(target=self.read, args=(items, queues[0]))]
+        for stage, queue, next_queue in zip(self.stages, queues, queues[1:]):
+            threads.extend(Thread(target=self.run, args=(stage, queue, next_queue)) for _ in range(self.workers))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            # Results in advance on the next expected one
+            pending = dict()
+            index, done = 0, 0
+            while done < self.workers:
+                item = self.get(queues[-1])
+                if item is DONE:
+                    done += 1
+                    continue
+                if isinstance(item[1], Failure):
+                    raise item[1].error
+                pending[item[0]] = item[1]
+                while index in pending:
+                    yield pending.pop(index)
+                    index += 1
+        finally:
+            self.stopped.set()
+
+    def read(self, items, queue):
+        """
+        Puts the numbered items into the first queue.
+
+        """
+        try:
+            for item in enumerate(items):
+                self.put(queue, item)
+        except Exception as error:
+            self.put(queue, (None, Failure(error)))
+        for _ in range(self.workers):
+            self.put(queue, DONE)
+
+    def run(self, stage, queue, next_queue):
+        """
+        Applies a stage to the items of a queue until the end of the previous stage.
+        Failures are passed on without being processed.
+
+        """
+        while True:
+            item = self.get(queue)
+            if item is DONE:
+                break
+            index, value = item
+            if not isinstance(value, Failure):
+                try:
+                    value = stage(value)
+                except Exception as error:
+                    value = Failure(error)
+            self.put(next_queue, (index, value))
+        self.put(next_queue, DONE)
+
+    def get(self, queue):
+        """
+        Waits for an item, unless the pipeline is interrupted.
+
+        """
+        while True:
+            try:
+                return queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                if self.stopped.is_set():
+                    raise SystemExit
+
+    def put(self, queue, item):
+        """
+        Waits for a free place to put an item, unless the pipeline is interrupted.
+
+        """
+        while True:
+            try:
+                return queue.put(item, timeout=POLL_INTERVAL)
+            except Full:
+                if self.stopped.is_set():
+                    raise SystemExit
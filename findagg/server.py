@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Daemon mode keeping the DRS index and the tests results warm to answer requests over HTTP.
+
+"""
+
+# Module imports
+import argparse
+import json
+import logging
+import os
+import signal
+import time
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock, Thread
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+
+from .findagg import HOST_POOL_SIZE, HTTP_RETRIES, THREAD_POOL_SIZE
+from .findagg import DRSIndex, MultilineFormatter, ProcessingContext, ResultStore, ThreddsCatalog
+from .findagg import get_request_context, search, validate_requirements
+from .matrix import StatusMatrix
+
+try:
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from urllib.parse import parse_qs, urlparse
+
+# Default localhost port
+PORT = 8642
+
+# Default time in seconds between background refreshes
+REFRESH_INTERVAL = 3600
+
+# Default number of requests whose results are kept
+MAX_REQUESTS = 64
+
+# Default time in seconds after which the results of a request not queried anymore are dropped
+IDLE_TIME = 24 * 3600
+
+# Requirements of the base processing context, before any request
+NO_REQUIREMENTS = {'ensembles': [], 'experiments': [], 'variables': {}}
+
+
+class Workspace(object):
+    """
+    Search results of a request, kept until the next refresh.
+    Results are replaced all at once so that readers never see a partial search.
+    The time of the last query tells whether the request is still worth refreshing.
+
+    :param dict requirements: The user requirements
+    :returns: The request workspace
+    :rtype: *Workspace*
+
+    """
+
+    def __init__(self, requirements):
+        self.requirements = requirements
+        self.results = None
+        self.matrix = None
+        self.updated = None
+        self.accessed = time.time()
+        self.lock = Lock()
+
+    def search(self, ctx, jobs):
+        """
+        Searches the aggregations of the request.
+
+        :param ProcessingContext ctx: The base processing context
+        :param int jobs: The number of models processed concurrently by each stage
+
+        """
+        request = get_request_context(ctx, self.requirements)
+        request.matrix = matrix = StatusMatrix(self.requirements['experiments'], self.requirements['variables'])
+        results = list(search(request, jobs))
+        for result in results:
+            matrix.add_result(result)
+        self.results, self.matrix, self.updated = results, matrix, datetime.now()
+
+    def get_results(self, ctx, jobs):
+        """
+        Returns the search results, searching first if the request is new.
+
+        :param ProcessingContext ctx: The base processing context
+        :param int jobs: The number of models processed concurrently by each stage
+        :returns: The models results
+        :rtype: *list*
+
+        """
+        if self.results is None:
+            with self.lock:
+                if self.results is None:
+                    self.search(ctx, jobs)
+        return self.results
+
+    def dump(self, ctx, jobs):
+        """
+        Returns the status table, the available aggregations and the missing data of the request.
+
+        :param ProcessingContext ctx: The base processing context
+        :param int jobs: The number of models processed concurrently by each stage
+        :returns: The JSON serializable response
+        :rtype: *dict*
+
+        """
+        results = self.get_results(ctx, jobs)
+        aggregations, missing = set(), set()
+        for result in results:
+            aggregations.update(result.aggregations)
+            missing.update(result.missing)
+        return {'updated': self.updated.isoformat(),
+                'models': [{'institute': result.institute,
+                            'model': result.model,
+                            'opendap': result.urls_status,
+                            'cdat': result.xmls_status} for result in results],
+                'aggregations': sorted(aggregations),
+                'missing': sorted(missing)}
+
+    def dump_coverage(self, ctx, jobs, max_missing):
+        """
+        Like :meth:`dump`, but returns the complete and best partial sets of models and ensembles.
+
+        :param ProcessingContext ctx: The base processing context
+        :param int jobs: The number of models processed concurrently by each stage
+        :param int max_missing: The maximum number of variables to give up
+        :returns: The JSON serializable response
+        :rtype: *dict*
+
+        """
+        self.get_results(ctx, jobs)
+        coverage = self.matrix.coverage(max_missing)
+        coverage['updated'] = self.updated.isoformat()
+        return coverage
+
+
+class Daemon(object):
+    """
+    Answers requests from warm results, refreshed in the background.
+    All requests share the workers, the HTTP connections and the tests results of the base context.
+    The least recently queried requests are dropped beyond the maximum number of requests,
+    and the requests not queried during the idle time are dropped before refreshing.
+
+    :param ArgumentParser args: Parsed command-line arguments
+    :returns: The daemon
+    :rtype: *Daemon*
+
+    """
+
+    def __init__(self, args):
+        self.ctx = copy_context(ProcessingContext(args, NO_REQUIREMENTS))
+        self.jobs = args.jobs
+        self.interval = args.interval
+        self.max_requests = args.max_requests
+        self.idle = args.idle
+        # Workspaces by request, from the least to the most recently queried
+        self.workspaces = OrderedDict()
+        self.lock = Lock()
+
+    def query(self, requirements, max_missing=None):
+        """
+        Returns the response to a request: the search results or, if ``max_missing`` is set,
+        the complete and best partial sets of models and ensembles.
+
+        :param dict requirements: The user requirements
+        :param int max_missing: The maximum number of variables to give up in partial sets
+        :returns: The JSON serializable response
+        :rtype: *dict*
+
+        """
+        key = json.dumps(requirements, sort_keys=True)
+        with self.lock:
+            workspace = self.workspaces.pop(key, None) or Workspace(requirements)
+            workspace.accessed = time.time()
+            self.workspaces[key] = workspace
+            while len(self.workspaces) > self.max_requests:
+                self.workspaces.popitem(last=False)
+        if max_missing is not None:
+            return workspace.dump_coverage(self.ctx, self.jobs, max_missing)
+        return workspace.dump(self.ctx, self.jobs)
+
+    def refresh(self):
+        """
+        Forgets the tests results and searches every known request again, except the idle ones which are dropped.
+        Previous results are served until the new ones are ready.
+
+        """
+        ctx = self.ctx
+        self.ctx = copy_context(ctx)
+        with self.lock:
+            for key, workspace in list(self.workspaces.items()):
+                if time.time() - workspace.accessed > self.idle:
+                    del self.workspaces[key]
+            workspaces = list(self.workspaces.values())
+        for workspace in workspaces:
+            try:
+                with workspace.lock:
+                    workspace.search(self.ctx, self.jobs)
+            except Exception as e:
+                logging.warning('Refresh failed ({0}).'.format(e))
+        logging.info('{0} request(s) refreshed.'.format(len(workspaces)))
+
+    def run_refresh(self):
+        """
+        Refreshes the known requests every interval, forever.
+
+        """
+        while True:
+            time.sleep(self.interval)
+            self.refresh()
+
+    def close(self):
+        """
+        Stops the workers and closes the HTTP connections and the cache.
+
+        """
+        self.ctx.pool.close()
+        self.ctx.prober.close()
+        if self.ctx.cache:
+            self.ctx.cache.close()
+
+
+def copy_context(ctx):
+    """
+    Returns a copy of the base processing context with new tests results and directories listings.
+    The tests results are shared by all requests, so that they do not rely on the index of any of them.
+
+    :param ProcessingContext ctx: The base processing context
+    :returns: The refreshed processing context
+    :rtype: *ProcessingContext*
+
+    """
+    refreshed = get_request_context(ctx, NO_REQUIREMENTS)
+    # Directories are listed again
+    refreshed.index = DRSIndex(NO_REQUIREMENTS, ctx.pool, ctx.metrics)
+    # Results lists are collected into the responses
+    refreshed.agg_file = refreshed.miss_file = True
+    refreshed.store = ResultStore(ctx.pool, ctx.prober, ctx.cache, ctx.catalog, None, ctx.metrics)
+    if ctx.catalog:
+        refreshed.catalog = refreshed.store.catalog = ThreddsCatalog(ctx.prober.session, ctx.metrics)
+    return refreshed
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers ``POST /`` and ``POST /complete?max_missing=1`` requests with a JSON template as body,
+    and ``GET /metrics``.
+
+    """
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/metrics':
+            self.respond(200, self.server.daemon.ctx.metrics.summary())
+        else:
+            self.respond(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') not in ('', '/complete'):
+            self.respond(404, {'error': 'Not found'})
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            requirements = validate_requirements(json.loads(body.decode('utf-8')))
+            max_missing = None
+            if url.path.rstrip('/') == '/complete':
+                max_missing = int(parse_qs(url.query).get('max_missing', ['1'])[0])
+        except Exception as e:
+            self.respond(400, {'error': str(e)})
+            return
+        try:
+            self.respond(200, self.server.daemon.query(requirements, max_missing))
+        except Exception as e:
+            logging.exception('Request failed')
+            self.respond(500, {'error': str(e)})
+
+    def respond(self, code, data):
+        content = json.dumps(data, indent=1).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def address_string(self):
+        # Unix sockets have no client address.
+        return str(self.client_address or 'unix')
+
+    def log_message(self, fmt, *args):
+        logging.debug(fmt % args)
+
+
+class LocalHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server listening on localhost.
+
+    """
+    daemon_threads = True
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """
+    Threaded HTTP server listening on a Unix socket.
+
+    """
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def get_args(argv):
+    """
+    Returns parsed command-line arguments of the daemon mode. See ``find_agg serve -h`` for full description.
+
+    :param list argv: The command-line arguments following ``serve``
+    :returns: The corresponding ``argparse`` Namespace
+    :rtype: *ArgumentParser*
+
+    """
+    parser = argparse.ArgumentParser(
+        prog='find_agg serve',
+        description="""
+        Keeps the CMIP5 index and the tests results in memory to answer requests in milliseconds.|n|n
+
+        POST a JSON template to the server to get the models status, the available aggregations|n
+        and the missing data, or to /complete to get the models and ensembles having all the|n
+        requested aggregations. GET /metrics to get the run metrics.|n|n
+
+        The default values are displayed next to the corresponding flags.
+        """,
+        formatter_class=MultilineFormatter,
+        add_help=False)
+    parser.add_argument(
+        'templates',
+        nargs='*',
+        type=argparse.FileType('r'),
+        help="""JSON templates to search before serving.""")
+    parser.add_argument(
+        '--port',
+        metavar=str(PORT),
+        type=int,
+        default=PORT,
+        help="""Localhost port to listen to.""")
+    parser.add_argument(
+        '--socket',
+        metavar='PATH',
+        type=str,
+        help="""Unix socket to listen to instead of a localhost port.""")
+    parser.add_argument(
+        '--interval',
+        metavar=str(REFRESH_INTERVAL),
+        type=int,
+        default=REFRESH_INTERVAL,
+        help="""Time in seconds between background refreshes.""")
+    parser.add_argument(
+        '--max-requests',
+        metavar=str(MAX_REQUESTS),
+        type=int,
+        default=MAX_REQUESTS,
+        help="""Number of requests kept, the least recently queried are dropped.""")
+    parser.add_argument(
+        '--idle',
+        metavar=str(IDLE_TIME),
+        type=int,
+        default=IDLE_TIME,
+        help="""Time in seconds after which a request not queried is not refreshed anymore.""")
+    parser.add_argument(
+        '--log',
+        metavar='$PWD',
+        type=str,
+        const=os.getcwd(),
+        nargs='?',
+        help="""Logfile directory.""")
+    parser.add_argument(
+        '--catalog',
+        action='store_true',
+        default=False,
+        help="""Reads the THREDDS catalog of each model.""")
+    parser.add_argument(
+        '--deep',
+        action='store_true',
+        default=False,
+        help="""Checks the files referenced by the xml aggregations.""")
+    parser.add_argument(
+        '--cache',
+        metavar='PATH',
+        type=str,
+        help="""SQLite file with the tests results of previous runs.""")
+    parser.add_argument(
+        '--max-age',
+        metavar='SECONDS',
+        type=int,
+        help="""Maximum age of cached tests results.""")
+    parser.add_argument(
+        '--jobs',
+        metavar='1',
+        type=int,
+        default=1,
+        help="""Number of models processed concurrently by each stage.""")
+    parser.add_argument(
+        '--threads',
+        metavar=str(THREAD_POOL_SIZE),
+        type=int,
+        default=THREAD_POOL_SIZE,
+        help="""Number of threads.""")
+    parser.add_argument(
+        '--host-threads',
+        metavar=str(HOST_POOL_SIZE),
+        type=int,
+        default=HOST_POOL_SIZE,
+        help="""Maximum number of concurrent HTTP requests per host.""")
+    parser.add_argument(
+        '--retries',
+        metavar=str(HTTP_RETRIES),
+        type=int,
+        default=HTTP_RETRIES,
+        help="""Number of retries upon HTTP timeouts or server errors.""")
+    parser.add_argument(
+        '-v',
+        action='store_true',
+        default=False,
+        help="""Verbose mode.""")
+    parser.add_argument(
+        '-h', '--help',
+        action='help',
+        help="""Show this help message and exit.""")
+    parser.set_defaults(agg=None, miss=None, incremental=None, refresh=False, fail_fast=False, matrix=None,
+                        coverage=None, complete=None, max_missing=1, shard=None, results=None, journal=None,
+                        status_only=False, resume=False)
+    return parser.parse_args(argv)
+
+
+def interrupt(signum, frame):
+    """
+    Stops serving upon ``SIGTERM`` like upon ``SIGINT``.
+
+    """
+    raise KeyboardInterrupt
+
+
+def serve(argv):
+    """
+    Daemon process that\:
+     * Instantiates the base processing context,
+     * Searches the given templates,
+     * Refreshes the known requests in the background,
+     * Answers requests until interrupted (``SIGINT`` or ``SIGTERM``).
+
+    :param list argv: The command-line arguments following ``serve``
+
+    """
+    args = get_args(argv)
+    daemon = Daemon(args)
+    for template in args.templates:
+        daemon.query(validate_requirements(json.load(template)))
+    if args.socket:
+        server = UnixHTTPServer(args.socket, RequestHandler)
+        logging.info('==> Serving on {0}'.format(args.socket))
+    else:
+        server = LocalHTTPServer(('127.0.0.1', args.port), RequestHandler)
+        logging.info('==> Serving on http://127.0.0.1:{0}/'.format(server.server_port))
+    server.daemon = daemon
+    signal.signal(signal.SIGTERM, interrupt)
+    refresher = Thread(target=daemon.run_refresh)
+    refresher.daemon = True
+    refresher.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+        daemon.close()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Snapshot of the CMIP5 directories and models results for incremental runs.
+
+"""
+
+# Module imports
+import hashlib
+import json
+import os
+from threading import Lock
+
+from .output import write_atomically
+
+
+class Snapshot(object):
+    """
+    Remembers the modification and inode change times of the indexed directories, their listing
+    and the results of each model from the last run with the same request.
+    A directory whose times did not change is not listed again and a model without any changed
+    directory reuses its previous results.
+
+    :param str path: The snapshot file
+    :param object request: Any JSON serializable object identifying the request (requirements, outputs)
+    :returns: The snapshot
+    :rtype: *Snapshot*
+
+    """
+
+    def __init__(self, path, request):
+        self.path = path
+        self.key = hashlib.md5(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+        self.directories = dict()
+        self.models = dict()
+        if os.path.isfile(path):
+            with open(path) as f:
+                previous = json.load(f)
+            if previous.get('key') == self.key:
+                self.directories = previous['directories']
+                self.models = previous['models']
+        self.new_directories = dict()
+        self.new_models = dict()
+        # The (institute, model) couples with a changed directory, added to by the workers listing models
+        self.changed = set()
+        self.lock = Lock()
+
+    def listdir(self, facets, path, list_dirs):
+        """
+        Returns the listing of a directory, from the snapshot if its times did not change.
+
+        :param tuple facets: The directory facets from the CMIP5 root folder
+        :param str path: The directory path
+        :param function list_dirs: The function listing a directory (None to only check the times)
+        :returns: The sub-directories names
+        :rtype: *list*
+
+        """
+        key = '/'.join(facets)
+        try:
+            st = os.stat(path)
+        except OSError:
+            if key in self.directories:
+                self.set_changed(facets)
+            return []
+        signature = [st.st_mtime, st.st_ctime]
+        previous = self.directories.get(key)
+        if previous and previous[:2] == signature and (previous[2] is not None or list_dirs is None):
+            children = previous[2]
+        else:
+            children = list_dirs(path) if list_dirs else None
+            self.set_changed(facets)
+        self.new_directories[key] = signature + [children]
+        return children
+
+    def set_changed(self, facets):
+        """
+        Records that the model of a directory has to be processed again.
+
+        :param tuple facets: The directory facets from the CMIP5 root folder
+
+        """
+        with self.lock:
+            self.changed.add(tuple(facets[:2]))
+
+    def is_changed(self, institute, model):
+        """
+        Returns True if a model has to be processed again.
+
+        :param str institute: The institute
+        :param str model: The model
+        :returns: True if the model is new or a directory of the model changed
+        :rtype: *boolean*
+
+        """
+        if '/'.join([institute, model]) not in self.models:
+            return True
+        with self.lock:
+            return (institute, model) in self.changed
+
+    def get_result(self, institute, model):
+        """
+        Returns the previous results of a model.
+
+        :param str institute: The institute
+        :param str model: The model
+        :returns: The model results as recorded by :meth:`set_result`
+        :rtype: *dict*
+
+        """
+        return self.models['/'.join([institute, model])]
+
+    def set_result(self, institute, model, result):
+        """
+        Records the results of a model.
+
+        :param str institute: The institute
+        :param str model: The model
+        :param dict result: The JSON serializable model results
+
+        """
+        self.new_models['/'.join([institute, model])] = result
+
+    def save(self):
+        """
+        Atomically writes the snapshot of this run.
+
+        """
+        write_atomically(self.path, json.dumps({'key': self.key,
+                                                'directories': self.new_directories,
+                                                'models': self.new_models}))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Search tests fixture: a synthetic CMIP5 tree published by a local THREDDS stand-in.
+
+"""
+
+# Module imports
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from threading import Thread
+
+import findagg.findagg as findagg
+from benchmarks.synthetic import SyntheticTree
+from benchmarks.thredds import ThreddsServer
+
+# Time in seconds after which a search is considered hanging
+TIMEOUT = 30
+
+# Module constants pointing to the CMIP5 tree and the THREDDS server, replaced during a test
+CONSTANTS = ['CMIP5', 'XML_ROOT', 'THREDDS_ROOT', 'THREDDS_CATALOG']
+
+
+class SearchTestCase(unittest.TestCase):
+    """
+    Runs ``find_agg`` upon a synthetic tree in a temporary directory, published by a local THREDDS stand-in.
+    The tree and server options are class attributes so that each test case picks its own.
+
+    """
+    # The synthetic tree options, see :class:`benchmarks.synthetic.SyntheticTree`
+    tree_options = dict(institutes=1, models=3, experiments=3, ensembles=2, variables=2,
+                        missing_data=0.1, missing_xml=0, missing_url=0)
+
+    # The THREDDS stand-in options, see :class:`benchmarks.thredds.ThreddsServer`
+    server_options = dict()
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='findagg-test-')
+        self.tree = SyntheticTree(os.path.join(self.workdir, 'CMIP5'), **self.tree_options)
+        self.server = ThreddsServer(available=self.tree.available, datasets=self.tree.datasets,
+                                    **self.server_options).start()
+        self.constants = dict((name, getattr(findagg, name)) for name in CONSTANTS)
+        findagg.CMIP5 = findagg.XML_ROOT = self.tree.root
+        findagg.THREDDS_ROOT = self.server.root
+        findagg.THREDDS_CATALOG = self.server.catalog
+        self.template = self.write_template('template')
+
+    def tearDown(self):
+        for name, value in self.constants.items():
+            setattr(findagg, name, value)
+        self.server.stop()
+        shutil.rmtree(self.workdir)
+
+    def path(self, name):
+        """
+        Returns the path of a file of the temporary directory.
+
+        """
+        return os.path.join(self.workdir, name)
+
+    def write_template(self, name, variables=None):
+        """
+        Writes a JSON template requesting the whole tree or some of its variables.
+
+        """
+        requirements = dict(self.tree.requirements)
+        if variables:
+            requirements['variables'] = dict((variable, self.tree.variables[variable]) for variable in variables)
+        path = self.path('{0}.json'.format(name))
+        with open(path, 'w') as f:
+            json.dump(requirements, f)
+        return path
+
+    def read(self, name):
+        """
+        Returns the sorted lines of an output file of the temporary directory.
+
+        """
+        with open(self.path(name)) as f:
+            return sorted(f.read().splitlines())
+
+    def search(self, *options, **kwargs):
+        """
+        Runs ``find_agg`` upon the templates in a thread, fails if it does not complete in time
+        and raises its error if any.
+
+        """
+        argv = sys.argv
+        sys.argv = ['find_agg'] + kwargs.get('templates', [self.template]) + list(options)
+        errors = list()
+
+        def run():
+            try:
+                findagg.main()
+            except BaseException as error:
+                errors.append(error)
+
+        try:
+            thread = Thread(target=run)
+            thread.daemon = True
+            thread.start()
+            thread.join(TIMEOUT)
+        finally:
+            sys.argv = argv
+        self.assertFalse(thread.is_alive(), 'The search hangs')
+        if errors:
+            raise errors[0]
+
+    def search_lists(self, *options, **kwargs):
+        """
+        Runs a search writing the aggregations and missing data lists and returns them.
+
+        """
+        self.search('--agg', self.path('agg.list'), '--miss', self.path('miss.list'), *options, **kwargs)
+        return self.read('agg.list'), self.read('miss.list')
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the search of several templates as a batch.
+
+"""
+
+# Module imports
+import unittest
+
+from fixtures import SearchTestCase
+
+
+class BatchTest(SearchTestCase):
+    """
+    Searches two templates of a synthetic tree as a batch.
+
+    """
+    tree_options = dict(institutes=1, models=2, experiments=3, ensembles=2, variables=2, missing_data=0.3)
+
+    def test_single_thread(self):
+        # The missing trees are resolved on the only worker
+        templates = [self.write_template('first', ['tas']), self.write_template('second', ['pr', 'tas'])]
+        self.search('--threads', '1', '--miss', self.path('missing_data.list'), templates=templates)
+        for name in ['first', 'second']:
+            self.assertTrue(self.read('missing_data.{0}.list'.format(name)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the persistent cache of the tests results.
+
+"""
+
+# Module imports
+import json
+import unittest
+
+from fixtures import SearchTestCase
+
+
+class CacheTest(SearchTestCase):
+    """
+    Searches a synthetic tree twice with the same cache.
+
+    """
+
+    def search_counters(self, *options):
+        """
+        Runs a cached search and returns its lists and counters.
+
+        """
+        lists = self.search_lists('--cache', self.path('cache.db'), '--metrics', self.path('metrics.json'),
+                                  *options)
+        with open(self.path('metrics.json')) as f:
+            return lists, json.load(f)['counters']
+
+    def test_trees(self):
+        expected, counters = self.search_counters()
+        self.assertTrue(expected[1])
+        self.assertTrue(counters.get('stat_calls'))
+        # Both the existing trees and the missing ones are read from the cache
+        lists, counters = self.search_counters()
+        self.assertEqual(lists, expected)
+        self.assertFalse(counters.get('stat_calls'))
+        self.assertTrue(counters.get('cache_hits'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the discovery of the THREDDS aggregations from the models catalogs.
+
+"""
+
+# Module imports
+import json
+import unittest
+
+from fixtures import SearchTestCase
+
+
+class CatalogTest(SearchTestCase):
+    """
+    Searches a synthetic tree with and without the catalogs of the THREDDS stand-in.
+
+    """
+    # Some aggregations have data but are not published
+    tree_options = dict(institutes=1, models=3, experiments=3, ensembles=2, variables=2,
+                        missing_data=0.1, missing_xml=0, missing_url=0.1)
+
+    def setUp(self):
+        super(CatalogTest, self).setUp()
+        self.expected = self.search_lists()
+        self.assertTrue(self.expected[0])
+        self.assertTrue(self.expected[1])
+        self.server.count = 0
+
+    def search_counters(self):
+        """
+        Runs a search with the catalogs and returns its counters.
+
+        """
+        self.assertEqual(self.search_lists('--catalog', '--metrics', self.path('metrics.json')), self.expected)
+        with open(self.path('metrics.json')) as f:
+            return json.load(f)['counters']
+
+    def test_datasets(self):
+        # One catalog request per model replaces the urls tests
+        counters = self.search_counters()
+        self.assertEqual(counters['catalog_requests'], 3)
+        self.assertNotIn('catalog_errors', counters)
+        self.assertEqual(self.server.count, 3)
+
+    def test_nested(self):
+        # The experiments catalogs are followed once, their references back to the model catalog are not
+        self.server.nested = True
+        self.search_counters()
+        self.assertEqual(self.server.count, 3 + 3 * 3)
+
+    def test_fallback(self):
+        # The urls of a model without catalog are tested one by one
+        datasets = self.tree.datasets
+        self.server.datasets = lambda institute, model: None if model == 'MODEL0-0' else datasets(institute, model)
+        counters = self.search_counters()
+        self.assertEqual(counters['catalog_errors'], 1)
+        self.assertGreater(self.server.count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
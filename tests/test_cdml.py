@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the deep check of the xml aggregations content.
+
+"""
+
+# Module imports
+import json
+import os
+import unittest
+
+import findagg.findagg as findagg
+from fixtures import SearchTestCase
+
+# Small CDML aggregation of the files of its directory
+CDML = """<?xml version="1.0"?>
+<dataset id="{name}" directory="." cdms_filemap="[[[{variable}],[{filemap}]]]">
+ <axis id="time" units="days since 1850-01-01" length="1872" partition="[0 1872]"/>
+ <variable id="{variable}" datatype="Float">
+  <domain><domElem name="time" start="0" length="1872"/></domain>
+ </variable>
+</dataset>
+"""
+
+
+class CdmlTest(SearchTestCase):
+    """
+    Checks the xml aggregations of a synthetic tree rewritten as small CDML files.
+
+    """
+    tree_options = dict(SearchTestCase.tree_options, models=2, missing_data=0)
+
+    def setUp(self):
+        super(CdmlTest, self).setUp()
+        self.xmls = dict()
+        for directory, _, files in os.walk(self.tree.root):
+            for name in files:
+                if name.endswith(findagg.XML_AGGREGATION_EXT):
+                    self.write_cdml(os.path.join(directory, name))
+                    self.xmls.setdefault(directory.split(os.sep)[-8], list()).append(os.path.join(directory, name))
+
+    def write_cdml(self, xml, files=None):
+        """
+        Writes a CDML aggregation of the data files of its directory or of the given files.
+
+        """
+        directory = os.path.dirname(xml)
+        if files is None:
+            files = sorted(name for name in os.listdir(directory) if name.endswith('.nc'))
+        variable = os.path.basename(directory)
+        filemap = ','.join('[{0},1872,-,-,-,{1}]'.format(i * 1872, name) for i, name in enumerate(files))
+        with open(xml, 'w') as f:
+            f.write(CDML.format(name=os.path.basename(xml), variable=variable, filemap=filemap))
+
+    def truncate(self, xml):
+        """
+        Truncates an xml aggregation as by an interrupted write.
+
+        """
+        with open(xml) as f:
+            content = f.read()
+        with open(xml, 'w') as f:
+            f.write(content[:len(content) // 2])
+
+    def statuses(self):
+        """
+        Runs a deep search and returns the xml aggregations status of each model.
+
+        """
+        self.search('--deep', '--results', self.path('results.json'))
+        with open(self.path('results.json')) as f:
+            lines = f.read().splitlines()[1:]
+        return dict((result['model'], result['xmls_status']) for result in map(json.loads, lines))
+
+    def test_intact(self):
+        for xmls in self.xmls.values():
+            for xml in xmls:
+                self.assertTrue(findagg.test_cdml(xml))
+        self.assertEqual(self.statuses(), {'MODEL0-0': findagg.COMPLETE, 'MODEL0-1': findagg.COMPLETE})
+
+    def test_truncated(self):
+        xml = self.xmls['MODEL0-0'][0]
+        self.truncate(xml)
+        self.assertFalse(findagg.test_cdml(xml))
+        open(xml, 'w').close()
+        self.assertFalse(findagg.test_cdml(xml))
+        self.assertEqual(self.statuses(), {'MODEL0-0': findagg.STALE, 'MODEL0-1': findagg.COMPLETE})
+
+    def test_outdated(self):
+        # The aggregation still references a file replaced in the latest directory
+        xml = self.xmls['MODEL0-1'][0]
+        name = os.path.basename(xml)[:-len(findagg.XML_AGGREGATION_EXT)]
+        self.write_cdml(xml, ['{0}_185001-189912.nc'.format(name), '{0}_190001-200512.nc'.format(name)])
+        self.assertFalse(findagg.test_cdml(xml))
+        self.assertEqual(self.statuses(), {'MODEL0-0': findagg.COMPLETE, 'MODEL0-1': findagg.STALE})
+
+
+if __name__ == '__main__':
+    unittest.main()
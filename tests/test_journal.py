@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the journal of the completed models and the resume of an interrupted run.
+
+"""
+
+# Module imports
+import json
+import os
+import unittest
+
+from findagg.journal import Journal
+from fixtures import SearchTestCase
+
+# Request of the unit tests
+REQUEST = {'requirements': {'variables': ['tas']}}
+
+
+class JournalTest(SearchTestCase):
+    """
+    Resumes journals written by hand or by a search of a synthetic tree.
+
+    """
+
+    def write_journal(self, path, models):
+        """
+        Writes a journal of completed models for the unit tests request.
+
+        """
+        journal = Journal(path, REQUEST)
+        for model in models:
+            journal.set_result('IPSL', model, {'institute': 'IPSL', 'model': model})
+        journal.file.close()
+
+    def test_torn_line(self):
+        path = self.path('findagg.journal')
+        self.write_journal(path, ['MODEL0', 'MODEL1'])
+        with open(path) as f:
+            lines = f.readlines()
+        for torn in [lines[-1][:-1], lines[-1][:len(lines[-1]) // 2]]:
+            # The interruption tore the last line, or the journal was truncated in the middle of it
+            with open(path, 'w') as f:
+                f.write(''.join(lines[:-1]) + torn)
+            journal = Journal(path, REQUEST, resume=True)
+            self.assertTrue(journal.is_completed('IPSL', 'MODEL0'))
+            self.assertFalse(journal.is_completed('IPSL', 'MODEL1'))
+            # The torn line is dropped before the journal goes on
+            journal.set_result('IPSL', 'MODEL1', {'institute': 'IPSL', 'model': 'MODEL1'})
+            journal.file.close()
+            with open(path) as f:
+                self.assertEqual(f.readlines(), lines)
+
+    def test_invalid(self):
+        path = self.path('findagg.journal')
+        self.write_journal(path, ['MODEL0'])
+        self.assertRaises(Exception, Journal, path, dict(REQUEST, deep=True), resume=True)
+        with open(path, 'w') as f:
+            f.write('{"key": ')
+        self.assertRaises(Exception, Journal, path, REQUEST, resume=True)
+
+    def test_resume(self):
+        path = self.path('findagg.journal')
+        expected = self.search_lists('--journal', path)
+        # The journal is only kept until the run completes
+        self.assertFalse(os.path.exists(path))
+        remove = Journal.remove
+        Journal.remove = lambda journal: journal.file.close()
+        try:
+            self.search_lists('--journal', path)
+        finally:
+            Journal.remove = remove
+        with open(path) as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 1 + self.tree_options['institutes'] * self.tree_options['models'])
+        # Interrupts the run while the second model was being journaled
+        with open(path, 'w') as f:
+            f.write(''.join(lines[:2]) + lines[2][:10])
+        lists = self.search_lists('--resume', '--journal', path, '--metrics', self.path('metrics.json'))
+        self.assertEqual(lists, expected)
+        with open(self.path('metrics.json')) as f:
+            self.assertEqual(json.load(f)['counters'].get('models_resumed'), 1)
+        self.assertFalse(os.path.exists(path))
+        # The journal of another request is refused
+        self.write_journal(path, ['MODEL0'])
+        self.assertRaises(Exception, self.search_lists, '--resume', '--journal', path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the status matrix of the tests results.
+
+"""
+
+# Module imports
+import os
+import shutil
+import tempfile
+import unittest
+
+from findagg.matrix import StatusMatrix
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class StatusMatrixTest(unittest.TestCase):
+    """
+    Records the tests of models with the same name under different institutes.
+
+    """
+
+    def setUp(self):
+        self.matrix = StatusMatrix(['historical'], ['tas'])
+        self.matrix.add('INST0', 'MODEL', 'opendap', 'historical', 'r1i1p1', 'tas', True)
+        self.matrix.add('INST1', 'MODEL', 'opendap', 'historical', 'r1i1p1', 'tas', False)
+
+    def test_rows(self):
+        self.assertEqual(len(self.matrix.rows), 2)
+        self.assertEqual(sorted(test[:2] for test in self.matrix.get_tests()),
+                         [('INST0', 'MODEL'), ('INST1', 'MODEL')])
+
+    def test_coverage(self):
+        coverage = self.matrix.coverage()
+        self.assertEqual(coverage['opendap']['complete'], [['INST0', 'MODEL', 'r1i1p1']])
+        summary = self.matrix.summary('model')
+        self.assertEqual(summary['INST0/MODEL']['opendap']['present'], 1)
+        self.assertEqual(summary['INST1/MODEL']['opendap']['present'], 0)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_save(self):
+        workdir = tempfile.mkdtemp(prefix='findagg-test-')
+        try:
+            path = os.path.join(workdir, 'matrix.npz')
+            self.matrix.save(path)
+            content = numpy.load(path)
+            self.assertEqual(list(content['institutes']), ['INST0', 'INST1'])
+            self.assertEqual(list(content['models']), ['MODEL', 'MODEL'])
+            self.assertEqual(content['status'][:, 0, 0, 0, 0].tolist(), [1, 2])
+        finally:
+            shutil.rmtree(workdir)
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_save_failure(self):
+        # A failed export leaves no temporary file
+        workdir = tempfile.mkdtemp(prefix='findagg-test-')
+        write_table = pyarrow.parquet.write_table
+
+        def fail(table, path):
+            write_table(table, path)
+            raise IOError('Disk full')
+
+        pyarrow.parquet.write_table = fail
+        try:
+            self.assertRaises(IOError, self.matrix.save, os.path.join(workdir, 'matrix.parquet'))
+            self.assertEqual(os.listdir(workdir), [])
+        finally:
+            pyarrow.parquet.write_table = write_table
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
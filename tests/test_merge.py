@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the merge of the shards results into the outputs of a single run.
+
+"""
+
+# Module imports
+import unittest
+
+from fixtures import SearchTestCase
+
+# Number of shards the tree is processed in
+SHARDS = 3
+
+
+class MergeTest(SearchTestCase):
+    """
+    Processes a synthetic tree in shards and merges their results.
+
+    """
+    tree_options = dict(SearchTestCase.tree_options, institutes=2, models=3)
+
+    def shard(self, index, *options):
+        """
+        Processes a shard of the tree and returns its results file.
+
+        """
+        path = self.path('results.{0}-{1}.json'.format(index, SHARDS))
+        self.search('--shard', '{0}/{1}'.format(index, SHARDS), '--results', path, *options)
+        return path
+
+    def merge(self, shards, *options):
+        """
+        Merges the results of shards.
+
+        """
+        self.search(*options, templates=['merge'] + shards)
+
+    def test_merge(self):
+        expected = self.search_lists('--coverage', self.path('coverage.json'))
+        coverage = self.read('coverage.json')
+        self.assertTrue(expected[0])
+        self.assertTrue(expected[1])
+        shards = [self.shard(index, '--coverage', self.path('shard.json')) for index in range(1, SHARDS + 1)]
+        self.merge(shards, '--agg', self.path('agg.list'), '--miss', self.path('miss.list'),
+                   '--coverage', self.path('coverage.json'))
+        self.assertEqual((self.read('agg.list'), self.read('miss.list')), expected)
+        self.assertEqual(self.read('coverage.json'), coverage)
+
+    def test_missing_shard(self):
+        shards = [self.shard(index) for index in range(1, SHARDS + 1)]
+        self.assertRaises(Exception, self.merge, shards[1:], '--agg', self.path('agg.list'))
+        self.assertRaises(Exception, self.merge, shards + shards[:1], '--agg', self.path('agg.list'))
+
+    def test_different_requests(self):
+        shards = [self.shard(index) for index in range(1, SHARDS)]
+        for options in [['--deep'], ['--catalog'], ['--coverage', self.path('shard.json')]]:
+            # A shard processed with other options does not complete the others
+            self.assertRaises(Exception, self.merge, shards + [self.shard(SHARDS, *options)])
+        # The status matrix cannot be built from shards processed without it
+        shards.append(self.shard(SHARDS))
+        self.merge(shards)
+        self.assertRaises(Exception, self.merge, shards, '--coverage', self.path('coverage.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
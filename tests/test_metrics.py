@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the run metrics outputs.
+
+"""
+
+# Module imports
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from findagg.metrics import Metrics
+
+
+class MetricsTest(unittest.TestCase):
+    """
+    Writes the metrics of models with the same name under different institutes.
+
+    """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='findagg-test-')
+        self.metrics = Metrics()
+        for institute in ['INST0', 'INST1']:
+            with self.metrics.phase('index', institute, 'MODEL'):
+                pass
+        for seconds in [0.1, 0.2, 0.3]:
+            self.metrics.observe('http', seconds)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_json(self):
+        path = os.path.join(self.workdir, 'metrics.json')
+        self.metrics.write_json(path)
+        with open(path) as f:
+            summary = json.load(f)
+        self.assertEqual(sorted(summary['models']), ['INST0/MODEL', 'INST1/MODEL'])
+        self.assertEqual(summary['latencies']['http']['count'], 3)
+        self.assertAlmostEqual(summary['latencies']['http']['sum'], 0.6)
+
+    def test_prometheus(self):
+        path = os.path.join(self.workdir, 'metrics.prom')
+        self.metrics.write_prometheus(path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        for institute in ['INST0', 'INST1']:
+            prefix = 'findagg_model_phase_seconds{{institute="{0}",model="MODEL",phase="index"}} '.format(institute)
+            self.assertTrue(any(line.startswith(prefix) for line in lines))
+        # A summary has its quantiles, sum and count samples
+        self.assertIn('# TYPE findagg_http_seconds summary', lines)
+        self.assertIn('findagg_http_seconds_sum 0.6', lines)
+        self.assertIn('findagg_http_seconds_count 3', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
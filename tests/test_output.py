@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the sorted and atomic output files.
+
+"""
+
+# Module imports
+import gzip
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from findagg.output import FILE_MODE, SortedWriter, atomic_path, write_atomically
+
+
+class OutputTest(unittest.TestCase):
+    """
+    Writes output files in a temporary directory.
+
+    """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='findagg-test-')
+        self.path = os.path.join(self.workdir, 'output.list')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def read(self, path=None):
+        """
+        Returns the content of an output file.
+
+        """
+        with open(path or self.path, 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def assertClean(self):
+        """
+        Checks that no temporary file is left next to the output.
+
+        """
+        self.assertEqual([name for name in os.listdir(self.workdir) if name.startswith('.')], [])
+
+    def test_spill(self):
+        # Lines spilled in several runs are merged in order, without duplicates
+        writer = SortedWriter(self.path, buffer_size=3)
+        writer.writelines(['d', 'b', 'a', 'e', 'b', 'c', 'a', 'f', 'e', 'd'])
+        self.assertEqual(len(writer.runs), 3)
+        writer.close()
+        self.assertEqual(self.read(), 'a\nb\nc\nd\ne\nf\n')
+        self.assertClean()
+
+    def test_gzip(self):
+        path = self.path + '.gz'
+        with SortedWriter(path) as writer:
+            writer.writelines(['b', 'a', 'b'])
+        with gzip.open(path, 'rb') as f:
+            self.assertEqual(f.read().decode('utf-8'), 'a\nb\n')
+
+    def test_mode(self):
+        write_atomically(self.path, 'content\n')
+        self.assertEqual(self.read(), 'content\n')
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), FILE_MODE)
+        self.assertClean()
+
+    def test_interrupted(self):
+        # A failed write leaves the previous output untouched and no temporary file
+        write_atomically(self.path, 'previous\n')
+        try:
+            with SortedWriter(self.path) as writer:
+                writer.write('next')
+                raise KeyboardInterrupt
+        except KeyboardInterrupt:
+            pass
+        self.assertEqual(self.read(), 'previous\n')
+        with self.assertRaises(ValueError):
+            with atomic_path(self.path) as tmp:
+                with open(tmp, 'w') as f:
+                    f.write('partial')
+                raise ValueError
+        self.assertEqual(self.read(), 'previous\n')
+        self.assertClean()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the HTTP probing against the fault-injecting THREDDS stand-in.
+
+"""
+
+# Module imports
+import random
+import threading
+import time
+import unittest
+
+import findagg.findagg as findagg
+from findagg.findagg import AIMDLimiter, CircuitBreaker, URLProber
+from findagg.metrics import Metrics
+from fixtures import SearchTestCase
+
+
+class LimiterTest(unittest.TestCase):
+    """
+    Adapts the limit of simultaneous requests to the responses.
+
+    """
+
+    def test_limit(self):
+        limiter = AIMDLimiter(8, target=0.1)
+        self.assertEqual(limiter.limit, 4)
+        # Errors and slow responses halve the limit, at most once per latency target
+        limiter.release(False, 0.0)
+        self.assertEqual(limiter.limit, 2)
+        limiter.release(True, 1.0)
+        self.assertEqual(limiter.limit, 2)
+        time.sleep(0.15)
+        limiter.release(True, 1.0)
+        self.assertEqual(limiter.limit, 1)
+        limiter.release(False, 0.0)
+        self.assertEqual(limiter.limit, 1)
+        # Fast successes increase it by about one per window of limit requests, up to the maximum
+        limiter.release(True, 0.0)
+        self.assertEqual(limiter.limit, 2)
+        limiter.release(True, 0.0)
+        limiter.release(True, 0.0)
+        self.assertTrue(2.5 < limiter.limit < 3)
+        for _ in range(100):
+            limiter.release(True, 0.0)
+        self.assertEqual(limiter.limit, 8)
+
+
+class BreakerTest(unittest.TestCase):
+    """
+    Opens and closes the circuit upon consecutive failures.
+
+    """
+
+    def test_circuit(self):
+        breaker = CircuitBreaker(threshold=3, cooldown=0.1)
+        self.assertFalse(breaker.failure())
+        self.assertFalse(breaker.failure())
+        self.assertTrue(breaker.failure())
+        self.assertFalse(breaker.allow())
+        # A single trial request per cool-down period, a success closes the circuit
+        time.sleep(0.15)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.success()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.failure())
+
+
+class ProberTest(SearchTestCase):
+    """
+    Tests urls and searches a synthetic tree through a failing THREDDS stand-in.
+
+    """
+    # Some aggregations have data but are not published
+    tree_options = dict(institutes=1, models=3, experiments=3, ensembles=2, variables=2,
+                        missing_data=0.1, missing_xml=0, missing_url=0.2)
+
+    def setUp(self):
+        super(ProberTest, self).setUp()
+        self.timings = dict((name, getattr(findagg, name)) for name in ['HTTP_TIMEOUT', 'HTTP_BACKOFF'])
+        findagg.HTTP_TIMEOUT = 0.2
+        findagg.HTTP_BACKOFF = 0.001
+        self.metrics = Metrics()
+        self.urls = sorted('{0}/{1}.{2}'.format(self.server.root.rsplit('/', 1)[0], dataset,
+                                                findagg.THREDDS_AGGREGATION_HTML_EXT)
+                           for dataset in self.tree.published)[:20]
+        random.seed(0)
+
+    def tearDown(self):
+        for name, value in self.timings.items():
+            setattr(findagg, name, value)
+        super(ProberTest, self).tearDown()
+
+    def probe(self, threshold=findagg.CIRCUIT_THRESHOLD, **kwargs):
+        """
+        Tests the urls with a new prober.
+
+        """
+        prober = URLProber(metrics=self.metrics, **kwargs)
+        prober.breaker = CircuitBreaker(threshold)
+        try:
+            return [prober(url) for url in self.urls]
+        finally:
+            prober.close()
+
+    def test_errors(self):
+        # Server errors are retried
+        self.server.error_rate = 0.5
+        self.assertEqual(self.probe(retries=20), [True] * len(self.urls))
+        self.assertTrue(self.metrics.counters['http_errors'])
+        self.assertTrue(self.metrics.counters['http_retries'])
+
+    def test_timeouts(self):
+        self.server.hang_rate, self.server.hang = 0.3, 0.5
+        self.assertEqual(self.probe(retries=20), [True] * len(self.urls))
+        self.assertTrue(self.metrics.counters['http_timeouts'])
+
+    def test_circuit(self):
+        # Once open, the circuit answers unknown without any request or aborts
+        self.server.error_rate = 1.0
+        self.assertEqual(self.probe(5, retries=0), [None] * len(self.urls))
+        self.assertEqual(self.server.count, 5)
+        self.assertEqual(self.metrics.counters['circuit_openings'], 1)
+        self.assertEqual(self.metrics.counters['circuit_rejections'], len(self.urls) - 5)
+        self.assertRaises(Exception, self.probe, 5, retries=0, abort=True)
+
+    def test_fail_fast(self):
+        threads = set(threading.enumerate())
+        self.server.error_rate = 1.0
+        # The pools are kept alive so that the garbage collection of the aborted search does not shut them down
+        pools, thread_pool = list(), findagg.ThreadPool
+
+        def create_pool(*args, **kwargs):
+            pools.append(thread_pool(*args, **kwargs))
+            return pools[-1]
+
+        findagg.ThreadPool = create_pool
+        try:
+            with self.assertRaises(Exception) as context:
+                self.search_lists('--retries', '0', '--fail-fast')
+        finally:
+            findagg.ThreadPool = thread_pool
+        self.assertTrue(pools)
+        self.assertEqual(str(context.exception), 'THREDDS server unavailable')
+        # The workers, the pipeline stages and the HTTP connections of the aborted search are shut down
+        for _ in range(10):
+            left = set(threading.enumerate()) - threads
+            if not left:
+                break
+            time.sleep(0.1)
+        self.assertFalse(left)
+
+    def test_unknown(self):
+        # Unknown urls are not missing, the other lists are unchanged
+        expected = self.search_lists()
+        self.server.error_rate = 1.0
+        aggregations, missing = self.search_lists('--retries', '0')
+        self.assertEqual(aggregations, [line for line in expected[0] if not line.startswith('http')])
+        urls = [line for line in expected[1] if line.startswith('http')]
+        self.assertTrue(set(missing) < set(expected[1]))
+        self.assertTrue(set(expected[1]) - set(missing) <= set(urls))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the daemon answering requests from warm results.
+
+"""
+
+# Module imports
+import unittest
+
+from findagg.server import Daemon, get_args
+from fixtures import SearchTestCase
+
+
+class DaemonTest(SearchTestCase):
+    """
+    Queries a daemon with requests upon some variables of a synthetic tree.
+
+    """
+    tree_options = dict(institutes=1, models=2, experiments=2, ensembles=2, variables=3,
+                        missing_data=0.1, missing_xml=0, missing_url=0)
+
+    def setUp(self):
+        super(DaemonTest, self).setUp()
+        self.daemon = Daemon(get_args(['--max-requests', '2', '--idle', '60']))
+
+    def tearDown(self):
+        self.daemon.close()
+        super(DaemonTest, self).tearDown()
+
+    def query(self, *variables):
+        """
+        Queries the daemon with the requirements of some variables.
+
+        """
+        requirements = dict(self.tree.requirements)
+        requirements['variables'] = dict((variable, self.tree.variables[variable]) for variable in variables)
+        return self.daemon.query(requirements)
+
+    def get_requests(self):
+        """
+        Returns the variables of the requests kept by the daemon, from the least recently queried.
+
+        """
+        return [sorted(workspace.requirements['variables']) for workspace in self.daemon.workspaces.values()]
+
+    def test_results(self):
+        self.assertEqual(self.query(*self.tree.variables)['aggregations'], self.search_lists()[0])
+
+    def test_least_recently_queried(self):
+        self.query('tas')
+        self.query('pr')
+        self.query('tas')
+        self.query('psl')
+        self.assertEqual(self.get_requests(), [['tas'], ['psl']])
+
+    def test_idle(self):
+        self.query('tas')
+        self.query('pr')
+        self.daemon.workspaces[list(self.daemon.workspaces)[0]].accessed -= 120
+        self.daemon.refresh()
+        self.assertEqual(self.get_requests(), [['pr']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the snapshot of the directories and models results.
+
+"""
+
+# Module imports
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from threading import Thread
+
+from findagg.findagg import list_dirs
+from findagg.snapshot import Snapshot
+
+# Models of the snapshot tree
+MODELS = [('INST0', 'MODEL0-{0}'.format(i)) for i in range(20)]
+
+
+class SnapshotTest(unittest.TestCase):
+    """
+    Lists the models directories of a small tree through successive snapshots.
+
+    """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='findagg-test-')
+        self.path = os.path.join(self.workdir, 'findagg.snapshot')
+        for institute, model in MODELS:
+            os.makedirs(os.path.join(self.workdir, institute, model, 'historical'))
+        self.index().save()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def listdir(self, snapshot, institute, model):
+        """
+        Lists the directories of a model through the snapshot.
+
+        """
+        facets = (institute, model)
+        for name in snapshot.listdir(facets, os.path.join(self.workdir, *facets), list_dirs):
+            snapshot.listdir(facets + (name,), os.path.join(self.workdir, *(facets + (name,))), list_dirs)
+
+    def index(self):
+        """
+        Lists every model and records their results into a new snapshot.
+
+        """
+        snapshot = Snapshot(self.path, {'request': 1})
+        for institute, model in MODELS:
+            self.listdir(snapshot, institute, model)
+            snapshot.set_result(institute, model, {'model': model})
+        return snapshot
+
+    def test_changed(self):
+        snapshot = self.index()
+        self.assertFalse(any(snapshot.is_changed(*couple) for couple in MODELS))
+        # Only the model with a new directory is processed again
+        time.sleep(0.01)
+        os.makedirs(os.path.join(self.workdir, 'INST0', 'MODEL0-1', 'historical', 'day'))
+        snapshot = self.index()
+        self.assertEqual([couple for couple in MODELS if snapshot.is_changed(*couple)], [('INST0', 'MODEL0-1')])
+
+    def test_concurrent(self):
+        # Models are checked while other workers list theirs
+        for institute, model in MODELS:
+            os.makedirs(os.path.join(self.workdir, institute, model, 'rcp85'))
+        snapshot = Snapshot(self.path, {'request': 1})
+        threads = [Thread(target=self.listdir, args=(snapshot,) + couple) for couple in MODELS]
+        for thread in threads:
+            thread.start()
+        checked = [snapshot.is_changed(*couple) for couple in MODELS * 10]
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(checked), len(MODELS) * 10)
+        self.assertTrue(all(snapshot.is_changed(*couple) for couple in MODELS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+"""
+   :platform: Unix
+   :synopsis: Tests the status-only survey along the runs saving their results.
+
+"""
+
+# Module imports
+import os
+import unittest
+
+from fixtures import SearchTestCase
+
+
+class StatusOnlyTest(SearchTestCase):
+    """
+    Surveys a synthetic tree before and after incremental searches.
+
+    """
+
+    def test_incremental_after_status_only(self):
+        # A status-only run neither saves nor reuses its partial results
+        snapshot, results = self.path('findagg.snapshot'), self.path('results.json')
+        for options in [['--incremental', snapshot], ['--results', results], ['--journal'], ['--resume'],
+                        ['--shard', '1/2']]:
+            self.assertRaises(Exception, self.search, '--status-only', *options)
+        self.search('--status-only')
+        self.assertFalse(os.path.exists(snapshot))
+        expected = self.search_lists()
+        self.assertTrue(expected[0])
+        self.assertTrue(expected[1])
+        for _ in range(2):
+            # The second run reuses the snapshot of the first one
+            self.assertEqual(self.search_lists('--incremental', snapshot, '--results', results), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()